@@ -1,14 +1,33 @@
 import argparse
+import ast
+import collections
+import contextlib
+import contextvars
+import functools
+import hashlib
 import importlib
+import importlib.metadata
+import io
+import json
+import mmap
 import time
 import sys
 import os
+import pickle
+import re
+import select
+import socket
+import socketserver
+import struct
 import subprocess
+import threading
 import traceback
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
 
-import pytest
 import yaml
 
+import yamlmaker
 from yamlmaker import Text
 from yamlmaker import generate
 from yamlmaker import panic
@@ -40,6 +59,72 @@ target_environments_dir: target_environments
 # Environments to ignore when setting pipelines
 ignore_environments:
 - common
+
+# Maximum fly requests per second, per concourse target. 0 is unlimited.
+# fly_requests_per_second: 2
+
+# Maximum pipelines being set at once, per concourse target, when setting all pipelines.
+# fly_max_in_flight: 1
+
+# Override the above per concourse target.
+# concourse_targets:
+#   my-team:
+#     fly_requests_per_second: 1
+#     fly_max_in_flight: 2
+
+# The file used to record progress when setting all pipelines, used by --resume.
+# journal_file: .cck-journal.json
+
+# The file used to record every pipeline cck has set, only these are ever orphans.
+# managed_pipelines_file: .cck-managed.json
+
+# Emit YAML anchors and aliases for fragments repeated within a pipeline.
+# yaml_anchors: false
+
+# A directory to cache rendered pipelines in, keyed by a hash of everything
+# they are rendered from. Disabled when empty.
+# render_cache_dir: .cck-cache
+
+# The file used to record how long each pipeline and environment takes, used by --shard.
+# timings_file: .cck-timings.json
+
+# Set one instanced pipeline per environment, using the env instance var,
+# instead of a separately named <env>-<name> pipeline.
+# instanced_pipelines: false
+
+# When analyzing, flag pipelines over this many times the median for any measure.
+# analysis_outlier_factor: 3
+
+# Merge resources with the same type and source within a pipeline into one.
+# dedupe_resources: false
+
+# The directory to keep pipeline snapshots in, defaults to <pipelines_test_dir>/snapshots.
+# snapshots_dir: pipeline_tests/snapshots
+
+# The unix socket cck --serve listens on, and cck --client connects to.
+# server_socket: .cck.sock
+
+# Render this many environments of a pipeline at once when setting pipelines, for
+# pipelines which opt in with pipeline_render_concurrently = True.
+# render_workers: 1
+
+# The bundle cck --compile-vars writes the target environments to, read by
+# concoursekit.Sources and concoursekit.Files when it exists.
+# vars_bundle: .cck-vars.bundle
+
+# Render each pipeline environment in a separate worker process, killed after
+# this many seconds. 0 renders in process without a limit.
+# render_timeout: 0
+
+# Megabytes a render worker may allocate beyond what it uses to start. 0 is unlimited.
+# render_memory_limit: 0
+
+# Write an OpenMetrics textfile of render, fly and pipeline measurements when
+# each run ends, i.e. for the node_exporter textfile collector. Disabled when empty.
+# metrics_file: cck.prom
+
+# Write every render, fly call and pipeline outcome as JSON lines when each run ends.
+# events_file: cck-events.jsonl
 """
 
 
@@ -55,11 +140,25 @@ def setup():
   commands.add_argument("--generate-pipeline", action="store_true", dest="gen_pipeline", help="generate a pipeline.yml config")
   commands.add_argument("--test-pipeline", action="store_true", dest="test_pipeline", help="run the test for one or more pipelines")
   commands.add_argument("--set-pipeline", action="store_true", dest="set_pipeline", help="set pipeline(s)")
+  commands.add_argument("--analyze", action="store_true", dest="analyze", help="estimate the ATC load of one or more pipelines")
+  commands.add_argument("--duplicates", action="store_true", dest="duplicates", help="find identical resources declared across pipelines")
+  commands.add_argument("--serve", action="store_true", dest="serve", help="keep pipelines loaded and serve render, plan and validate requests on a local socket")
+  commands.add_argument("--client", action="store", dest="client", choices=["render", "plan", "validate"], help="send a request to a running cck --serve")
+  commands.add_argument("--compile-vars", action="store_true", dest="compile_vars", help="compile the target environments into a vars bundle for faster rendering")
+  commands.add_argument("--orphans", action="store_true", dest="orphans", help="find pipelines on concourse which are no longer generated by cck")
 
   parser.add_argument("--plan", action="store_true", dest="plan_flag", default=False, help="View the plan only, don't set anything.")
   parser.add_argument("--all", action="store_true", dest="all_flag", help="Specify all pipelines or all environments, depending on context.")
   parser.add_argument("--env", action="append", dest="environments", default=[], help="the name of a target environment; specify multiple times for multiple environments.")
   parser.add_argument("--name", action="store", dest="name", help="the name of the pipeline.py file")
+  parser.add_argument("--render-cache", action="store", dest="render_cache_dir", help="a directory to cache rendered pipelines in, overrides render_cache_dir.")
+  parser.add_argument("--shard", action="store", dest="shard", help="only work on shard i of n, given as i/n, balanced by historic timings.")
+  parser.add_argument("--snapshot", action="store_true", dest="snapshot_flag", default=False, help="With --test-pipeline, compare rendered pipelines against their snapshots.")
+  parser.add_argument("--update-snapshots", action="store_true", dest="update_snapshots_flag", default=False, help="With --snapshot, write the rendered pipelines as the new snapshots.")
+  parser.add_argument("--resume", action="store_true", dest="resume_flag", default=False, help="Resume setting all pipelines from where a previous run stopped.")
+  parser.add_argument("--metrics-file", action="store", dest="metrics_file", help="write an OpenMetrics textfile when the run ends, overrides metrics_file.")
+  parser.add_argument("--events-file", action="store", dest="events_file", help="write a JSON lines event stream when the run ends, overrides events_file.")
+  parser.add_argument("--destroy", action="store_true", dest="destroy_flag", default=False, help="Destroy orphaned pipelines found with --orphans.")
 
   parsed_args = parser.parse_args()
 
@@ -67,14 +166,36 @@ def setup():
     parsed_args.init,
     parsed_args.gen_pipeline,
     parsed_args.test_pipeline,
-    parsed_args.set_pipeline
+    parsed_args.set_pipeline,
+    parsed_args.orphans,
+    parsed_args.analyze,
+    parsed_args.duplicates,
+    parsed_args.serve,
+    bool(parsed_args.client),
+    parsed_args.compile_vars
   ]
 
   if not True in one_of_commands:
     parser.print_usage()
-    panic('You Must Specify a Top-Level command: --init | --generate-pipeline | --test-pipeline | --set-pipeline')
+    panic('You Must Specify a Top-Level command: --init | --generate-pipeline | --test-pipeline | --set-pipeline | --orphans | --analyze | --duplicates | --serve | --client | --compile-vars')
+
+  if parsed_args.shard:
+    parsed_args.shard = parse_shard(parsed_args.shard)
     
-  return  parser.parse_args()
+  return parsed_args
+
+
+def parse_shard(shard):
+  """
+  Parse a shard given as i/n, where i is 1 to n.
+  """
+  try:
+    shard_index, shard_count = [int(part) for part in shard.split("/")]
+  except ValueError:
+    panic(f"Invalid Shard: {shard} - Must be given as i/n i.e. 1/4")
+  if not 1 <= shard_index <= shard_count:
+    panic(f"Invalid Shard: {shard} - i must be between 1 and n")
+  return shard_index, shard_count
 
 
 def main():
@@ -86,10 +207,30 @@ def main():
 
   if os.path.exists(".cck.yml"):
     cck_config = load_config()
-    if parsed_args.gen_pipeline: generate_pipeline(parsed_args.name, parsed_args.environments, cck_config, parsed_args.plan_flag)
-    if parsed_args.test_pipeline: test_pipeline(parsed_args.name, parsed_args.all_flag, cck_config)
-    if parsed_args.set_pipeline and parsed_args.name: set_pipeline(parsed_args.name, parsed_args.environments, parsed_args.all_flag, cck_config, parsed_args.plan_flag)
-    if parsed_args.set_pipeline and not parsed_args.name: set_pipelines(parsed_args.environments, parsed_args.all_flag, cck_config, parsed_args.plan_flag)
+    if parsed_args.render_cache_dir: cck_config["render_cache_dir"] = parsed_args.render_cache_dir
+    if parsed_args.metrics_file: cck_config["metrics_file"] = parsed_args.metrics_file
+    if parsed_args.events_file: cck_config["events_file"] = parsed_args.events_file
+    # --compile-vars rebuilds the bundle, so never reads through the old one
+    use_vars_bundle(None if parsed_args.compile_vars else cck_config["vars_bundle"])
+    try:
+      if parsed_args.gen_pipeline: generate_pipeline(parsed_args.name, parsed_args.environments, cck_config, parsed_args.plan_flag)
+      if parsed_args.test_pipeline and parsed_args.snapshot_flag: test_snapshots(parsed_args.name, parsed_args.environments, cck_config, parsed_args.update_snapshots_flag)
+      if parsed_args.test_pipeline and not parsed_args.snapshot_flag: test_pipeline(parsed_args.name, parsed_args.all_flag, cck_config, parsed_args.shard)
+      if parsed_args.set_pipeline and parsed_args.name:
+        skipped = set_pipeline(parsed_args.name, parsed_args.environments, parsed_args.all_flag, cck_config, parsed_args.plan_flag)
+        if skipped: panic(f"Skipped {len(skipped)} pipelines which exceeded their render limits: {', '.join(skipped)}")
+      if parsed_args.set_pipeline and not parsed_args.name: set_pipelines(parsed_args.environments, parsed_args.all_flag, cck_config, parsed_args.plan_flag, parsed_args.resume_flag, parsed_args.shard)
+      if parsed_args.orphans: find_orphans(cck_config, parsed_args.destroy_flag)
+      if parsed_args.analyze: analyze_pipelines(parsed_args.name, parsed_args.environments, cck_config)
+      if parsed_args.duplicates: find_duplicate_resources(parsed_args.name, parsed_args.environments, cck_config)
+      if parsed_args.serve: serve(cck_config)
+      if parsed_args.client: client_request(parsed_args.client, parsed_args.name, parsed_args.environments, cck_config)
+      if parsed_args.compile_vars: compile_vars(cck_config)
+    except RenderLimitExceeded as e:
+      panic(f"Pipeline render exceeded its limits: {e}")
+    finally:
+      # the server writes the metrics for each request as it finishes, which a client mustn't overwrite
+      if not (parsed_args.serve or parsed_args.client): METRICS.write(cck_config["metrics_file"], cck_config["events_file"])
   else:
     if parsed_args.init: 
       initialize_cck()
@@ -126,6 +267,36 @@ def load_config():
     if "_dir" in key and not os.path.exists(cck_config[key]):
       panic("Required Directory: {dir_name} - Does not Exist".format(dir_name=cck_config[key]))
 
+  #
+  # optional keys fall back to a default when they are not set
+  #
+  optional_config_keys = {
+    "fly_requests_per_second": ((int, float), 0),
+    "fly_max_in_flight": (int, 1),
+    "concourse_targets": (dict, {}),
+    "journal_file": (str, ".cck-journal.json"),
+    "managed_pipelines_file": (str, ".cck-managed.json"),
+    "yaml_anchors": (bool, False),
+    "render_cache_dir": (str, ""),
+    "timings_file": (str, ".cck-timings.json"),
+    "instanced_pipelines": (bool, False),
+    "analysis_outlier_factor": ((int, float), 3),
+    "dedupe_resources": (bool, False),
+    "snapshots_dir": (str, os.path.join(cck_config["pipelines_test_dir"], "snapshots")),
+    "server_socket": (str, ".cck.sock"),
+    "render_workers": (int, 1),
+    "vars_bundle": (str, ".cck-vars.bundle"),
+    "render_timeout": ((int, float), 0),
+    "render_memory_limit": (int, 0),
+    "metrics_file": (str, ""),
+    "events_file": (str, "")
+  }
+
+  for key, (required_type, default) in optional_config_keys.items():
+    if key not in cck_config:
+      cck_config[key] = default
+    elif not isinstance(cck_config[key], required_type):
+      panic(f"Invalid Config: Key: {key} - Is not Type {required_type}")
 
   return cck_config
 
@@ -148,6 +319,36 @@ def initialize_cck():
   print("To change the defaults, edit the .cck.yml file within this directory.")
 
 
+RENDERING_ENVIRONMENT = contextvars.ContextVar("RENDERING_ENVIRONMENT", default=None)
+
+
+def env(env_variable):
+  """
+  Drop in replacement for yamlmaker.env which reads ENVIRONMENT from the
+  current rendering context, so environments can render on separate threads.
+  Falls back to os.getenv, returning "" rather than None.
+  """
+  if env_variable == "ENVIRONMENT":
+    environment = RENDERING_ENVIRONMENT.get()
+    if environment is not None: return environment
+  var = os.getenv(env_variable)
+  return var if var else ""
+
+
+@contextlib.contextmanager
+def rendering_environment(environment):
+  """
+  Render within an environment.  ENVIRONMENT is also written to os.environ
+  for pipelines still using yamlmaker.env, which is only safe on one thread.
+  """
+  os.environ["ENVIRONMENT"] = environment
+  token = RENDERING_ENVIRONMENT.set(environment)
+  try:
+    yield environment
+  finally:
+    RENDERING_ENVIRONMENT.reset(token)
+
+
 def import_pipeline(name, pipelines_dir):
   """
   Attempt to import a pipeline based on file_name or panic
@@ -160,7 +361,7 @@ def import_pipeline(name, pipelines_dir):
     panic(f"Pipeline: {pipelines_dir}/{name}.py - contains a Syntax Error.", e)
 
 
-def generate_pipeline(name, environments, cck_config, plan_flag, pipeline=None):
+def generate_pipeline(name, environments, cck_config, plan_flag, pipeline=None, instanced=False):
   """
   Generate a pipeline config and write it to a yaml file.
   """
@@ -170,33 +371,360 @@ def generate_pipeline(name, environments, cck_config, plan_flag, pipeline=None):
   pipelines_dir = cck_config["pipelines_dir"]
 
   environment = environments[0] #  only generate 1 environment, ignore the rest
-  os.environ["ENVIRONMENT"] = environment
+  started = time.monotonic()
 
   if not plan_flag: print(Text.blue(f"Generating Pipeline to {name}.yml"))
-  if not pipeline: pipeline = import_pipeline(name, pipelines_dir)
+
+  #
+  # a cache hit skips importing and executing the pipeline entirely
+  #
+  render_cache = RenderCache(cck_config) if cck_config["render_cache_dir"] else None
+  if render_cache:
+    module_name = pipeline.__name__.split(".")[-1] if pipeline else name
+    cache_key = render_cache.key(module_name, environment, instanced)
+    if cache_key and render_cache.fetch(cache_key, f"{name}.yml"):
+      METRICS.render(name, environment, time.monotonic() - started, os.path.getsize(f"{name}.yml"), cached=True)
+      return
+
+  if not pipeline:
+    with rendering_environment(environment):
+      pipeline = import_pipeline(name, pipelines_dir)
 
   try:
     try:
-      pass
-      config = pipeline.pipeline_config()
+      if cck_config["render_timeout"] or cck_config["render_memory_limit"]:
+        config = supervised_render(pipeline, environment, cck_config)
+      else:
+        with rendering_environment(environment):
+          config = pipeline.pipeline_config()
+    except RenderLimitExceeded:
+      raise
     except Exception as e:
-      exc_type, exc_value, exc_tb = sys.exc_info()
-      error = traceback.format_exception(exc_type, exc_value, exc_tb)[-2]
+      if isinstance(e, RenderError):
+        error = e.error
+      else:
+        exc_type, exc_value, exc_tb = sys.exc_info()
+        error = traceback.format_exception(exc_type, exc_value, exc_tb)[-2]
       print(Text.red(f"ENVIRONMENT: {environment}"))
       print(Text.red(error))
       panic(f"Pipeline: {pipelines_dir}/{name}.py Encountered an Python Exception", e)
+    if isinstance(config, Pipeline): config = config.to_dict()
     if type(config) is not dict: 
-      panic(f"Pipeline: {pipelines_dir}/{name}.py pipeline_config() MUST return a dictionary.")
-    generate(pipeline.pipeline_config(), name)
+      panic(f"Pipeline: {pipelines_dir}/{name}.py pipeline_config() MUST return a dictionary or a Pipeline.")
+    if cck_config["dedupe_resources"]: config = dedupe_resources(config)
+    if instanced: config = instance_config(config, environment)
+    write_pipeline(config, name, cck_config)
   except AttributeError:
     panic(f"Pipeline: {pipelines_dir}/{name}.py MUST have a top-level function defined as pipeline_config()")
 
+  if render_cache and cache_key: render_cache.store(cache_key, f"{name}.yml")
+  METRICS.render(name, environment, time.monotonic() - started, os.path.getsize(f"{name}.yml"))
+
+
+class RenderError(Exception):
+  """
+  pipeline_config() raised within a supervised render worker.
+  """
+
+  def __init__(self, message, error):
+    super().__init__(message)
+    self.error = error  # the line of the traceback which raised
+
 
-def test_pipeline(name, all_flag, cck_config):
+class RenderLimitExceeded(Exception):
+  """
+  A supervised render ran past render_timeout, render_memory_limit or died.
+  """
+
+  def __init__(self, message, duration, peak_rss):
+    super().__init__(f"{message} after {duration:.1f}s, peak RSS {peak_rss:.0f}MB")
+    self.duration = duration
+    self.peak_rss = peak_rss
+
+
+# reads sys.path and the render_worker arguments from stdin before importing anything else
+RENDER_WORKER = "import pickle, sys; sys.path[:], args = pickle.load(sys.stdin.buffer); from concoursekit import render_worker; render_worker(*args)"
+
+
+def supervised_render(pipeline, environment, cck_config):
+  """
+  Run pipeline_config() in a fresh worker process, killed once it runs for
+  longer than render_timeout seconds, and unable to allocate more than
+  render_memory_limit megabytes beyond what the worker uses to start.
+
+  The worker is started with subprocess rather than os.fork, as cck is
+  threaded by now and a forked child could inherit a lock held by another
+  thread, i.e. on stdout, and deadlock on it.  The pipeline is imported again
+  within the worker, by its module name.
+  """
+  if not hasattr(os, "wait4"):
+    panic("render_timeout and render_memory_limit require os.wait4")
+
+  timeout = cck_config["render_timeout"]
+  memory_limit = cck_config["render_memory_limit"]
+
+  read_fd, write_fd = os.pipe()
+  started = time.monotonic()
+  worker = subprocess.Popen([sys.executable, "-c", RENDER_WORKER], stdin=subprocess.PIPE, pass_fds=(write_fd,))
+  os.close(write_fd)
+  try:
+    worker.stdin.write(pickle.dumps((sys.path, (pipeline.__name__, environment, memory_limit, write_fd))))
+    worker.stdin.close()
+  except BrokenPipeError:
+    pass  # the worker already died, which is reported below
+
+  #
+  # keep draining the pipe so a large config can't block the worker
+  #
+  chunks = []
+  timed_out = False
+  try:
+    while True:
+      remaining = timeout - (time.monotonic() - started) if timeout else None
+      if remaining is not None and remaining <= 0:
+        timed_out = True
+        break
+      ready, _, _ = select.select([read_fd], [], [], remaining)
+      if not ready: continue
+      chunk = os.read(read_fd, 65536)
+      if not chunk: break
+      chunks.append(chunk)
+  finally:
+    os.close(read_fd)
+    if timed_out: worker.kill()
+    # reaped here rather than by worker.wait() for its resource usage
+    _, status, rusage = os.wait4(worker.pid, 0)
+    worker.returncode = os.waitstatus_to_exitcode(status)
+
+  duration = time.monotonic() - started
+  peak_rss = rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)  # bytes on macOS, KB elsewhere
+
+  if timed_out:
+    raise RenderLimitExceeded(f"exceeded render_timeout of {timeout}s", duration, peak_rss)
+  try:
+    outcome, value, error = pickle.loads(b"".join(chunks))
+  except Exception:
+    raise RenderLimitExceeded(f"render worker died with status {status}", duration, peak_rss)
+  if outcome == "memory":
+    raise RenderLimitExceeded(f"exceeded render_memory_limit of {memory_limit}MB", duration, peak_rss)
+  if outcome == "error":
+    raise RenderError(value, error)
+  return value
+
+
+def render_worker(module_name, environment, memory_limit, write_fd):
+  """
+  The worker side of supervised_render, which never returns.
+  """
+  import resource
+
+  payload = pickle.dumps(("memory", None, None))  # built up front, there may be no memory left later
+  try:
+    if memory_limit:
+      try:
+        with open("/proc/self/statm") as statm:
+          address_space = int(statm.read().split()[0]) * mmap.PAGESIZE
+      except OSError:
+        address_space = 0  # without /proc the limit is absolute
+      limit = address_space + memory_limit * 1024 * 1024
+      resource.setrlimit(resource.RLIMIT_AS, (limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+    with rendering_environment(environment):
+      pipeline = importlib.import_module(module_name)
+      config = plain_value(pipeline.pipeline_config())
+    payload = pickle.dumps(("ok", config, None))
+  except MemoryError:
+    pass
+  except BaseException as e:
+    exc_type, exc_value, exc_tb = sys.exc_info()
+    try:
+      payload = pickle.dumps(("error", str(e), traceback.format_exception(exc_type, exc_value, exc_tb)[-2]))
+    except MemoryError:
+      pass
+
+  try:
+    view = memoryview(payload)
+    while view:
+      view = view[os.write(write_fd, view):]
+    sys.stdout.flush()
+  finally:
+    os._exit(0)
+
+
+class RenderCache(object):
+  """
+  Content addressed cache of rendered pipelines.  The key is a hash of the
+  pipeline module, the local modules it imports, the environment, its vars
+  files and concoursekit itself, so a hit can be used without running
+  pipeline_config().  Values read from other OS environment variables are
+  not part of the key.
+  """
+
+  def __init__(self, cck_config):
+    self.cck_config = cck_config
+    self.cache_dir = cck_config["render_cache_dir"]
+    os.makedirs(self.cache_dir, exist_ok=True)
+
+  def key(self, module_name, environment, instanced=False):
+    """
+    Compute the cache key, or None if the pipeline module does not exist.
+    """
+    module_file = os.path.join(self.cck_config["pipelines_dir"], f"{module_name}.py")
+    if not os.path.exists(module_file): return None
+
+    digest = hashlib.sha256()
+    digest.update(f"concoursekit {concoursekit_version()}\n".encode())
+    digest.update(f"environment {environment}\n".encode())
+    digest.update(f"yaml_anchors {self.cck_config['yaml_anchors']} dedupe_resources {self.cck_config['dedupe_resources']} instanced {instanced}\n".encode())
+
+    source_files = [__file__, module_file] + sorted(local_imports(module_file))
+    vars_files = environment_files(self.cck_config["target_environments_dir"])
+    for file_path in source_files + vars_files:
+      digest.update(f"{file_path} {FILE_HASHES.get(file_path)}\n".encode())
+
+    return digest.hexdigest()
+
+  def fetch(self, cache_key, file_path):
+    """
+    Copy a cached render to file_path, returning whether it was a hit.
+    """
+    cached_path = os.path.join(self.cache_dir, f"{cache_key}.yml")
+    if not os.path.exists(cached_path): return False
+    with open(cached_path, "rb") as cached, open(file_path, "wb") as file:
+      file.write(cached.read())
+    return True
+
+  def store(self, cache_key, file_path):
+    """
+    Store a render, written atomically as runners may share the directory.
+    """
+    cached_path = os.path.join(self.cache_dir, f"{cache_key}.yml")
+    temp_path = f"{cached_path}.{os.getpid()}.tmp"
+    with open(file_path, "rb") as file, open(temp_path, "wb") as cached:
+      cached.write(file.read())
+    os.replace(temp_path, cached_path)
+
+
+class FileHashes(object):
+  """
+  File hashes remembered while a file's mtime and size are unchanged, so
+  every cache key after the first within a run only stats the files.
+  """
+
+  def __init__(self):
+    self.hashes = {}
+    self.lock = threading.Lock()
+
+  def get(self, file_path):
+    stat = os.stat(file_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with self.lock:
+      cached = self.hashes.get(file_path)
+    if cached and cached[0] == signature: return cached[1]
+
+    file_hash = hash_file(file_path)
+    with self.lock:
+      self.hashes[file_path] = (signature, file_hash)
+    return file_hash
+
+
+FILE_HASHES = FileHashes()
+
+
+@functools.lru_cache(maxsize=None)
+def concoursekit_version():
+  """
+  The installed concoursekit version, if it is installed.
+  """
+  try:
+    return importlib.metadata.version("concoursekit")
+  except importlib.metadata.PackageNotFoundError:
+    return "unknown"
+
+
+def local_imports(file_path, seen=None):
+  """
+  Find the files of every module, within the current directory, imported by
+  a python file and the modules it imports in turn.  Only the source is
+  parsed, nothing is imported.
+  """
+  seen = set() if seen is None else seen
+  try:
+    with open(file_path) as file:
+      tree = ast.parse(file.read(), filename=file_path)
+  except (SyntaxError, ValueError):
+    return seen
+
+  modules = []
+  for node in ast.walk(tree):
+    if isinstance(node, ast.Import):
+      modules += [(alias.name, ".") for alias in node.names]
+    elif isinstance(node, ast.ImportFrom):
+      base_dir = "."
+      if node.level:
+        base_dir = os.path.dirname(file_path) or "."
+        for _ in range(node.level - 1): base_dir = os.path.dirname(base_dir) or "."
+      module = node.module or ""
+      modules.append((module, base_dir))
+      # from package import module
+      modules += [(f"{module}.{alias.name}".strip("."), base_dir) for alias in node.names]
+
+  for module, base_dir in modules:
+    if not module: continue
+    parts = module.split(".")
+    # importing a.b.c also imports the packages a and a.b
+    for depth in range(1, len(parts) + 1):
+      module_path = os.path.join(base_dir, *parts[:depth])
+      for candidate in [f"{module_path}.py", os.path.join(module_path, "__init__.py")]:
+        candidate = os.path.normpath(candidate)
+        if os.path.isfile(candidate) and candidate not in seen:
+          seen.add(candidate)
+          local_imports(candidate, seen)
+
+  return seen
+
+
+def environment_files(target_environments_dir):
+  """
+  Find every file under the target environments.  Any pipeline may read any
+  environment's vars, i.e. stage promoting what is in prod, so all are hashed.
+  """
+  files = []
+  for root, dirs, file_names in os.walk(target_environments_dir):
+    dirs.sort()
+    files += [os.path.join(root, file_name) for file_name in sorted(file_names)]
+  return files
+
+
+def write_pipeline(config, name, cck_config):
+  """
+  Write a generated config to <name>.yml, using anchors for fragments if enabled.
+  """
+  if not cck_config["yaml_anchors"]:
+    generate(config, name)
+    return
+
+  with open(f"{name}.yml", "w") as file:
+    yaml.dump(config, file, Dumper=FragmentDumper, sort_keys=False, default_flow_style=False)
+
+
+def test_pipeline(name, all_flag, cck_config, shard=None):
   """
   Test one or more pipelies using pytest.
   """
-  if all_flag:
+  # imported here as pytest is slow to import and only needed for testing
+  import pytest
+
+  if all_flag and shard:
+    #
+    # pipelines are weighted by how long all their environments take to render
+    #
+    timings = Timings(cck_config["timings_file"])
+    names = shard_work(list_pipelines(cck_config["pipelines_dir"]), shard, lambda name: timings.total(f"{name}/"))
+    print(Text.cyan(f"Testing Shard {shard[0]}/{shard[1]}: {', '.join(names)}"))
+    if not names: return
+    keywords = " or ".join(f"{name}_test" for name in names)
+    pytest.main(["-s", "-k", f"{cck_config['pipelines_test_dir']} and ({keywords})", "-rA"])
+  elif all_flag:
     print(Text.cyan("Testing All Pipelines"))
     pytest.main(["-s", "-k", cck_config["pipelines_test_dir"], "-rA"])
   else:
@@ -204,7 +732,98 @@ def test_pipeline(name, all_flag, cck_config):
     pytest.main(["-s", "-k", name, "-rA"])
 
   
-def set_pipelines(environments, all_flag, cck_config, plan_flag):
+def test_snapshots(name, environments, cck_config, update_flag):
+  """
+  Compare every rendered pipeline and environment against its committed
+  snapshot.  Hashes are compared first, a structural diff is only worked out
+  for snapshots which don't match.  The snapshot file itself is always hashed,
+  so an edited or conflicted snapshot can't pass on the manifest alone.
+  """
+  snapshots_dir = cck_config["snapshots_dir"]
+  manifest_path = os.path.join(snapshots_dir, "snapshots.json")
+  manifest = {}
+  if os.path.exists(manifest_path):
+    with open(manifest_path) as file:
+      manifest = json.load(file)
+
+  print(Text.cyan(f"Testing Snapshots: {name or 'All Pipelines'}"))
+  passed, failed, updated = [], [], []
+  rendered_keys = set()
+  for fleet_pipeline, rendered in render_fleet(cck_config, [name] if name else None, environments):
+    key = f"{fleet_pipeline.origin_name}/{fleet_pipeline.environment}"
+    rendered_keys.add(key)
+    snapshot_path = os.path.join(snapshots_dir, fleet_pipeline.origin_name, f"{fleet_pipeline.environment}.yml")
+    rendered_hash = hashlib.sha256(rendered.encode()).hexdigest()
+
+    snapshot_hash = hash_file(snapshot_path) if os.path.exists(snapshot_path) else None
+
+    if snapshot_hash == rendered_hash:
+      passed.append(key)
+    elif update_flag:
+      os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+      with open(snapshot_path, "w") as file:
+        file.write(rendered)
+      manifest[key] = rendered_hash
+      updated.append(key)
+    elif snapshot_hash is None:
+      print(Text.red(f"FAILED {key} - no snapshot, run with --update-snapshots to create it"))
+      failed.append(key)
+    else:
+      with open(snapshot_path) as file:
+        differences = diff_configs(yaml.safe_load(file), yaml.safe_load(rendered))
+      print(Text.red(f"FAILED {key} - does not match {snapshot_path}"))
+      for difference in differences[:20]: print(Text.red(f"  {difference}"))
+      if len(differences) > 20: print(Text.red(f"  ... and {len(differences) - 20} more"))
+      failed.append(key)
+
+  if update_flag:
+    #
+    # snapshots for pipelines or environments which no longer render are removed,
+    # only when everything was rendered, otherwise they just weren't selected.
+    #
+    if not (name or environments):
+      for key in sorted(set(manifest) - rendered_keys):
+        origin_name, environment = key.split("/")
+        snapshot_path = os.path.join(snapshots_dir, origin_name, f"{environment}.yml")
+        if os.path.exists(snapshot_path): os.remove(snapshot_path)
+        del manifest[key]
+    os.makedirs(snapshots_dir, exist_ok=True)
+    with open(manifest_path, "w") as file:
+      json.dump(manifest, file, indent=2, sort_keys=True)
+    for key in updated: print(Text.yellow(f"UPDATED {key}"))
+
+  print(Text.bold(f"{len(passed)} passed, {len(failed)} failed, {len(updated)} updated"))
+  if failed: panic(f"{len(failed)} snapshot(s) do not match.")
+  return passed, failed, updated
+
+
+def diff_configs(expected, actual, path=""):
+  """
+  List the differences between two configs by their path i.e. jobs[0].name
+  """
+  if type(expected) is dict and type(actual) is dict:
+    differences = []
+    for key in expected:
+      if key not in actual: differences.append(f"{path}.{key}: removed".lstrip("."))
+      else: differences += diff_configs(expected[key], actual[key], f"{path}.{key}")
+    for key in actual:
+      if key not in expected: differences.append(f"{path}.{key}: added".lstrip("."))
+    return differences
+
+  if type(expected) is list and type(actual) is list:
+    differences = []
+    for index in range(max(len(expected), len(actual))):
+      if index >= len(actual): differences.append(f"{path}[{index}]: removed".lstrip("."))
+      elif index >= len(expected): differences.append(f"{path}[{index}]: added".lstrip("."))
+      else: differences += diff_configs(expected[index], actual[index], f"{path}[{index}]")
+    return differences
+
+  if expected != actual:
+    return [f"{path}: {expected!r} -> {actual!r}".lstrip(".")]
+  return []
+
+
+def set_pipelines(environments, all_flag, cck_config, plan_flag, resume_flag=False, shard=None):
   """
   Set multiple pipelines
   """
@@ -219,16 +838,147 @@ def set_pipelines(environments, all_flag, cck_config, plan_flag):
       print(Text.yellow("Aborting!"))
       sys.exit(0)
 
+  timings = Timings(cck_config["timings_file"])
+  work = {pipeline: environments for pipeline in list_pipelines(pipelines_dir)}
+  if shard: work = shard_pipelines(work, shard, cck_config, timings)
+
+  # progress is only journaled when pipelines are actually being set
+  journal = None if plan_flag else Journal(cck_config["journal_file"], resume_flag)
+  managed = None if plan_flag else ManagedPipelines(cck_config["managed_pipelines_file"])
+  scheduler = None if plan_flag else TargetScheduler(cck_config, timings)
+
+  #
+  # pipelines are rendered one at a time, setting them is handed to the
+  # scheduler which works through each concourse target concurrently.
+  #
+  skipped = []
+  try:
+    for pipeline, pipeline_environments in work.items():
+      skipped += set_pipeline(pipeline, pipeline_environments, all_flag, cck_config, plan_flag, journal, scheduler, timings, managed)
+    if scheduler: scheduler.wait()
+  finally:
+    if scheduler: scheduler.shutdown()
+    timings.save()
+
+  #
+  # the journal is left unfinished so --resume retries the failed and skipped pipelines
+  #
+  failed = sorted(journal.failed) if journal else []
+  if failed or skipped:
+    if failed: print(Text.red(f"Failed to set {len(failed)} pipelines: {', '.join(failed)}"))
+    if skipped: print(Text.red(f"Skipped {len(skipped)} pipelines which exceeded their render limits: {', '.join(skipped)}"))
+    panic("Not every pipeline was set, run again with --resume to retry the rest.")
+  if journal: journal.finish()
+
+
+def shard_pipelines(work, shard, cck_config, timings):
+  """
+  Reduce the pipelines to set down to the pipeline/environment pairs within a shard.
+  """
+  pipelines_dir = cck_config["pipelines_dir"]
+
+  pairs = []
+  for name, environments in work.items():
+    pipeline = import_pipeline(name, pipelines_dir)
+    allowed_environments = determine_pipeline_environments(pipeline, name, environments, pipelines_dir, cck_config["target_environments_dir"], cck_config["ignore_environments"])
+    pairs += [(name, environment) for environment in allowed_environments]
+
+  shard_pairs = shard_work(pairs, shard, lambda pair: timings.get(f"{pair[0]}/{pair[1]}"))
+  print(Text.cyan(f"Shard {shard[0]}/{shard[1]}: {len(shard_pairs)} of {len(pairs)} pipeline environments"))
+
+  sharded_work = {}
+  for name, environment in sorted(shard_pairs):
+    sharded_work.setdefault(name, []).append(environment)
+  return sharded_work
+
+
+def shard_work(items, shard, duration):
+  """
+  Deterministically split items into shards of roughly equal total duration,
+  returning the items for shard i of n.  Items are placed longest first onto
+  the least loaded shard, ties go to the lowest shard and the lowest item.
+  """
+  shard_index, shard_count = shard
+  durations = {item: duration(item) for item in items}
+
+  # items without any history are assumed to take the median time
+  known = sorted(seconds for seconds in durations.values() if seconds is not None)
+  default = known[len(known) // 2] if known else 1.0
+
+  loads = [0.0] * shard_count
+  shards = [[] for _ in range(shard_count)]
+  for item in sorted(items, key=lambda item: (-(durations[item] if durations[item] is not None else default), item)):
+    lightest = min(range(shard_count), key=lambda index: (loads[index], index))
+    loads[lightest] += durations[item] if durations[item] is not None else default
+    shards[lightest].append(item)
+
+  return sorted(shards[shard_index - 1])
+
+
+class Timings(object):
+  """
+  How long each pipeline/environment pair took on previous runs, persisted
+  so shards can be balanced by duration rather than count.
+  """
+
+  def __init__(self, file_path):
+    self.file_path = file_path
+    self.durations = {}
+    self.measured = {}
+    self.lock = threading.Lock()
+
+    if os.path.exists(file_path):
+      with open(file_path) as file:
+        try:
+          self.durations = json.load(file)
+        except ValueError:
+          print(Text.yellow(f"Warning - Timings: {file_path} is corrupt and will be replaced."))
+
+  def get(self, key):
+    """
+    The last recorded duration for a key, None if it has never been recorded.
+    """
+    return self.durations.get(key)
+
+  def total(self, prefix):
+    """
+    The total recorded duration for every key starting with prefix.
+    """
+    durations = [seconds for key, seconds in self.durations.items() if key.startswith(prefix)]
+    return sum(durations) if durations else None
+
+  def add(self, key, seconds):
+    """
+    Add time spent on a key during this run.
+    """
+    with self.lock:
+      self.measured[key] = self.measured.get(key, 0.0) + seconds
+
+  def save(self):
+    """
+    Merge this run's durations into the timings file.
+    """
+    if not self.measured: return
+    durations = self.durations | {key: round(seconds, 3) for key, seconds in self.measured.items()}
+    temp_path = f"{self.file_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as file:
+      json.dump(durations, file, indent=2, sort_keys=True)
+    os.replace(temp_path, self.file_path)
+
+
+def list_pipelines(pipelines_dir):
+  """
+  List the names of all pipeline.py files within the pipelines directory.
+  """
   # raw [('pipelines', [], ['foo.py', 'bar.py', ...])]
   pipelines = [pipeline[2] for pipeline in os.walk(pipelines_dir)][0]
-
-  for pipeline in pipelines:
-    set_pipeline(pipeline.replace(".py", ""), environments, all_flag, cck_config, plan_flag)
+  return [pipeline.replace(".py", "") for pipeline in sorted(pipelines) if pipeline.endswith(".py") and not pipeline.startswith("__")]
 
 
-def set_pipeline(name, environments, all_flag, cck_config, plan_flag):
+def set_pipeline(name, environments, all_flag, cck_config, plan_flag, journal=None, scheduler=None, timings=None, managed=None):
   """ 
-  Set a single pipeline in one or more environments
+  Set a single pipeline in one or more environments, returning the refs of
+  any skipped for exceeding their render limits.
   """
 
   target_environments_dir = cck_config["target_environments_dir"]
@@ -241,25 +991,67 @@ def set_pipeline(name, environments, all_flag, cck_config, plan_flag):
   allowed_environments = determine_pipeline_environments(pipeline, name, environments, pipelines_dir, target_environments_dir, ignore_environments)
   origin_name = name
   name = name.replace("_", "-").lower()
+  if managed is None and not plan_flag: managed = ManagedPipelines(cck_config["managed_pipelines_file"])
 
   if plan_flag and allowed_environments: 
     print(Text.bold(f"Pipeline Plan for: {name} - origin | pipeline-name | concourse-target | fly options | validity"))
 
+  #
+  # module level attributes are read with one environment loaded at a time.
+  # each environment is rendered straight after, unless the pipeline opted in
+  # to rendering them all at once afterwards, from the module as loaded for
+  # the last one.
+  #
+  render_concurrently = cck_config["render_workers"] > 1 and len(allowed_environments) > 1 and determine_render_concurrently(pipeline, origin_name, pipelines_dir)
+  targets = []
+  skipped = []
+
+  def render(fleet_pipeline):
+    try:
+      return render_pipeline(fleet_pipeline, cck_config, plan_flag)
+    except RenderLimitExceeded as e:
+      print(Text.red(f"Skipping pipeline: {fleet_pipeline.pipeline_ref} - {e}"))
+      METRICS.outcome("skipped", fleet_pipeline.pipeline_ref)
+      skipped.append(fleet_pipeline.pipeline_ref)
+      if timings: timings.add(f"{origin_name}/{fleet_pipeline.environment}", e.duration)
+      return None
+
   for environment in allowed_environments:
-    os.environ["ENVIRONMENT"] = environment
-    importlib.reload(pipeline)
+    started = time.monotonic()
+    with rendering_environment(environment):
+      importlib.reload(pipeline)
     pipeline_suffix = get_pipeline_suffix(pipeline)
     concourse_target = determine_concourse_target(pipeline, cck_config["concourse_target"])
-      
-    if pipeline_suffix:
-      pipeline_name = f"{environment}-{name}-{pipeline_suffix}"
-    else:
-      pipeline_name = f"{environment}-{name}"
+    instance_environment = environment if determine_instanced(pipeline, cck_config["instanced_pipelines"]) else None
+    pipeline_name = determine_pipeline_name(name, environment, pipeline_suffix, instance_environment)
+    pipeline_ref = determine_pipeline_ref(pipeline_name, instance_environment)
+    fleet_pipeline = FleetPipeline(origin_name, environment, pipeline, concourse_target, pipeline_name, pipeline_ref, instance_environment)
 
-    if not plan_flag: print(Text.green(f"Setting pipeline: {pipeline_name}"))
+    if not plan_flag: print(Text.green(f"Setting pipeline: {pipeline_ref}"))
 
-    generate_pipeline(pipeline_name, [environment], cck_config, plan_flag, pipeline)
+    if not render_concurrently and render(fleet_pipeline) is None: continue
     fly_options = determine_fly_options(pipeline, cck_config["fly_default_options"])
+    targets.append((fleet_pipeline, fly_options, time.monotonic() - started))
+
+  if render_concurrently:
+    with ThreadPoolExecutor(max_workers=cck_config["render_workers"]) as executor:
+      render_seconds = list(executor.map(lambda target: render(target[0]), targets))
+    targets = [(fleet_pipeline, fly_options, seconds + rendered) for (fleet_pipeline, fly_options, seconds), rendered in zip(targets, render_seconds) if rendered is not None]
+
+  for fleet_pipeline, fly_options, seconds in targets:
+    started = time.monotonic() - seconds
+    _, environment, _, concourse_target, pipeline_name, pipeline_ref, instance_environment = fleet_pipeline
+    timing_key = f"{origin_name}/{environment}"
+    config_name = pipeline_config_name(pipeline_name, instance_environment)
+
+    journal_entry = None
+    if journal:
+      journal_entry = (journal, f"{concourse_target}/{pipeline_ref}", hash_file(f"{config_name}.yml"))
+      if journal.is_complete(*journal_entry[1:]):
+        print(Text.yellow(f"Skipping pipeline: {pipeline_ref} - already set by a previous run"))
+        METRICS.outcome("skipped", pipeline_ref)
+        os.remove(f"{config_name}.yml")
+        continue
 
     if plan_flag: 
 
@@ -273,7 +1065,7 @@ def set_pipeline(name, environments, all_flag, cck_config, plan_flag):
 
       fly_options_string = " ".join(fly_options)
 
-      output = fly_run(['fly', 'validate-pipeline', '--config', f"{pipeline_name}.yml"], stdout=subprocess.DEVNULL)
+      output = fly_run(['fly', 'validate-pipeline', '--config', f"{config_name}.yml"], stdout=subprocess.DEVNULL)
       if output.returncode == 0:
         valid = Text.green("valid")
         arrow = ""
@@ -281,29 +1073,490 @@ def set_pipeline(name, environments, all_flag, cck_config, plan_flag):
         valid = Text.red("invalid")
         arrow = Text.red("└───> ")
 
-      print(f"{arrow}{pipelines_dir}/{origin_name}.py | {pipeline_name} | {concourse_target} | {fly_options_string} | {valid}")
+      print(f"{arrow}{pipelines_dir}/{origin_name}.py | {pipeline_ref} | {concourse_target} | {fly_options_string} | {valid}")
+
+      os.remove(f"{config_name}.yml")
+
+    elif scheduler:
+      scheduler.submit(concourse_target, apply_pipeline, pipeline_name, concourse_target, fly_options, journal_entry, instance_environment, managed=managed, interactive_lock=scheduler.interactive_lock, timing_key=timing_key)
+
+    else:
+      apply_pipeline(pipeline_name, concourse_target, fly_options, journal_entry, instance_environment, managed=managed)
+
+    # time spent setting the pipeline through the scheduler is added by the scheduler
+    if timings: timings.add(timing_key, time.monotonic() - started)
 
+  return skipped
+
+
+def render_pipeline(fleet_pipeline, cck_config, plan_flag):
+  """
+  Generate the config for a pipeline/environment pair, returning the seconds it took.
+  """
+  started = time.monotonic()
+  config_name = pipeline_config_name(fleet_pipeline.pipeline_name, fleet_pipeline.instance_environment)
+  generate_pipeline(config_name, [fleet_pipeline.environment], cck_config, plan_flag, fleet_pipeline.module, instanced=bool(fleet_pipeline.instance_environment))
+  return time.monotonic() - started
+
+
+def apply_pipeline(pipeline_name, concourse_target, fly_options, journal_entry=None, instance_environment=None, rate_limiter=None, managed=None, interactive_lock=None):
+  """
+  Invoke fly to set a generated pipeline and apply its fly options.  An
+  interactive set-pipeline holds interactive_lock while it prompts.
+  """
+  def run(command, lock=None):
+    if rate_limiter: rate_limiter.wait()
+    with lock or contextlib.nullcontext():
+      return fly_run(command)
+
+  pipeline_ref = determine_pipeline_ref(pipeline_name, instance_environment)
+  config_name = pipeline_config_name(pipeline_name, instance_environment)
+
+  set_command = ['fly', '-t', concourse_target, 'set-pipeline', '--pipeline', pipeline_name , '--config', f"{config_name}.yml"]
+  if instance_environment: set_command += ['--instance-var', f"env={instance_environment}"]
+  if "non-interactive" in fly_options: set_command.append("--non-interactive")    
+  output = run(set_command, None if "non-interactive" in fly_options else interactive_lock)
+  
+  # Visibility and Pause State
+  if "expose-pipeline" in fly_options:
+    expose_command = ['fly', '-t', concourse_target, 'expose-pipeline', '--pipeline', pipeline_ref]
+    run(expose_command)
+  if "hide-pipeline" in fly_options:
+    hide_command = ['fly', '-t', concourse_target, 'hide-pipeline', '--pipeline', pipeline_ref]
+    run(hide_command)
+  if "unpause-pipeline" in fly_options:
+    unpause_command = ['fly', '-t', concourse_target, 'unpause-pipeline', '--pipeline', pipeline_ref]
+    run(unpause_command)
+  if "pause-pipeline" in fly_options:
+    pause_command = ['fly', '-t', concourse_target, 'pause-pipeline', '--pipeline', pipeline_ref]
+    run(pause_command)
+
+  METRICS.outcome("set" if output.returncode == 0 else "failed", pipeline_ref)
+  if output.returncode != 0: print(Text.red(f"Failed to set pipeline: {pipeline_ref}"))
+  if managed and output.returncode == 0: managed.record(concourse_target, pipeline_ref)
+  if journal_entry:
+    journal, journal_key, config_hash = journal_entry
+    if output.returncode == 0:
+      journal.record(journal_key, config_hash)
     else:
-      
-      set_command = ['fly', '-t', concourse_target, 'set-pipeline', '--pipeline', pipeline_name , '--config', f"{pipeline_name}.yml"]
-      if "non-interactive" in fly_options: set_command.append("--non-interactive")    
-      fly_run(set_command)
-      
-      # Visibility and Pause State
-      if "expose-pipeline" in fly_options:
-        expose_command = ['fly', '-t', concourse_target, 'expose-pipeline', '--pipeline', pipeline_name]
-        fly_run(expose_command)
-      if "hide-pipeline" in fly_options:
-        hide_command = ['fly', '-t', concourse_target, 'hide-pipeline', '--pipeline', pipeline_name]
-        fly_run(hide_command)
-      if "unpause-pipeline" in fly_options:
-        unpause_command = ['fly', '-t', concourse_target, 'unpause-pipeline', '--pipeline', pipeline_name]
-        fly_run(unpause_command)
-      if "pause-pipeline" in fly_options:
-        pause_command = ['fly', '-t', concourse_target, 'pause-pipeline', '--pipeline', pipeline_name]
-        fly_run(pause_command)
-
-    os.remove(f"{pipeline_name}.yml")
+      journal.fail(journal_key)
+
+  os.remove(f"{config_name}.yml")
+
+
+def target_setting(cck_config, concourse_target, key):
+  """
+  A setting for a concourse target, falling back to the top-level default.
+  """
+  target_config = cck_config["concourse_targets"].get(concourse_target) or {}
+  return target_config.get(key, cck_config[key])
+
+
+class TargetScheduler(object):
+  """
+  Work through fly operations for each concourse target concurrently.  Every
+  target has its own pool of workers and request rate limit, so a slow or
+  overloaded ATC doesn't hold up rollouts to healthy ones.
+  """
+
+  def __init__(self, cck_config, timings=None):
+    self.cck_config = cck_config
+    self.timings = timings
+    self.pools = {}
+    self.rate_limiters = {}
+    self.futures = []
+    # only one interactive fly command may prompt on the terminal at a time
+    self.interactive_lock = threading.Lock()
+
+  def submit(self, concourse_target, function, *args, timing_key=None, **kwargs):
+    """
+    Queue function(*args, rate_limiter=..., **kwargs) to run against a concourse target.
+    """
+    if concourse_target not in self.pools:
+      self.pools[concourse_target] = ThreadPoolExecutor(
+        max_workers=max(1, target_setting(self.cck_config, concourse_target, "fly_max_in_flight")),
+        thread_name_prefix=f"cck-{concourse_target}"
+      )
+      self.rate_limiters[concourse_target] = RateLimiter(target_setting(self.cck_config, concourse_target, "fly_requests_per_second"))
+    rate_limiter = self.rate_limiters[concourse_target]
+
+    def timed():
+      started = time.monotonic()
+      try:
+        return function(*args, rate_limiter=rate_limiter, **kwargs)
+      finally:
+        if self.timings and timing_key: self.timings.add(timing_key, time.monotonic() - started)
+
+    self.futures.append(self.pools[concourse_target].submit(timed))
+
+  def wait(self):
+    """
+    Wait for all queued work, then raise the first error encountered.  An
+    error on one target doesn't stop the work queued for the others.
+    """
+    concurrent.futures.wait(self.futures)
+    futures, self.futures = self.futures, []
+    for future in futures:
+      future.result()
+
+  def shutdown(self):
+    for pool in self.pools.values():
+      pool.shutdown(wait=False, cancel_futures=True)
+    self.pools = {}
+
+
+def hash_file(file_path):
+  """
+  Return the sha256 hex digest of a file's contents.
+  """
+  with open(file_path, "rb") as file:
+    return hashlib.sha256(file.read()).hexdigest()
+
+
+class Journal(object):
+  """
+  Persisted record of the pipelines set during a run, so a failed run can be resumed.
+  """
+
+  def __init__(self, file_path, resume):
+    """
+    Load the previous run's journal when resuming, otherwise start a new one.
+    """
+    self.file_path = file_path
+    self.entries = {}
+    self.failed = []
+    self.lock = threading.Lock()
+
+    if resume:
+      if os.path.exists(file_path):
+        with open(file_path) as file:
+          try:
+            self.entries = json.load(file)
+          except ValueError:
+            panic(f"Journal: {file_path} is corrupt, run again without --resume.")
+        print(Text.cyan(f"Resuming - {len(self.entries)} pipeline(s) already set."))
+      else:
+        print(Text.yellow(f"Warning - No journal found at {file_path}, nothing to resume."))
+
+    self.save()
+
+  def is_complete(self, key, config_hash):
+    """
+    A pipeline is complete if it was set with the exact same config.
+    """
+    return self.entries.get(key) == config_hash
+
+  def record(self, key, config_hash):
+    """
+    Record a pipeline as set and persist the journal immediately.
+    """
+    with self.lock:
+      self.entries[key] = config_hash
+      self.save()
+
+  def fail(self, key):
+    """
+    Record a pipeline which fly failed to set, so the run is left to resume.
+    """
+    with self.lock:
+      self.failed.append(key)
+
+  def save(self):
+    """
+    Write the journal atomically so an interrupted write never corrupts it.
+    """
+    temp_path = f"{self.file_path}.tmp"
+    with open(temp_path, "w") as file:
+      json.dump(self.entries, file, indent=2, sort_keys=True)
+    os.replace(temp_path, self.file_path)
+
+  def finish(self):
+    """
+    The run completed, there is nothing left to resume.
+    """
+    if os.path.exists(self.file_path): os.remove(self.file_path)
+
+
+class ManagedPipelines(object):
+  """
+  Persisted record of every pipeline cck has set, by concourse target.  Only
+  these are ever treated as orphans, so pipelines set by hand are left alone.
+  """
+
+  def __init__(self, file_path):
+    self.file_path = file_path
+    self.pipelines = {}
+    self.lock = threading.Lock()
+
+    if os.path.exists(file_path):
+      with open(file_path) as file:
+        try:
+          self.pipelines = {concourse_target: set(pipeline_refs) for concourse_target, pipeline_refs in json.load(file).items()}
+        except (ValueError, AttributeError, TypeError):
+          panic(f"Managed Pipelines: {file_path} is corrupt, remove it and set pipelines again to rebuild it.")
+
+  def targets(self):
+    return set(self.pipelines)
+
+  def get(self, concourse_target):
+    return self.pipelines.get(concourse_target, set())
+
+  def record(self, concourse_target, pipeline_ref):
+    """
+    Record a pipeline as set, persisting the file when it is new.
+    """
+    with self.lock:
+      if pipeline_ref in self.get(concourse_target): return
+      self.pipelines.setdefault(concourse_target, set()).add(pipeline_ref)
+      self.save()
+
+  def forget(self, concourse_target, pipeline_ref):
+    """
+    Forget a pipeline once it has been destroyed.
+    """
+    with self.lock:
+      self.get(concourse_target).discard(pipeline_ref)
+      self.save()
+
+  def save(self):
+    """
+    Write the file atomically so an interrupted write never corrupts it.
+    """
+    temp_path = f"{self.file_path}.tmp"
+    with open(temp_path, "w") as file:
+      json.dump({concourse_target: sorted(pipeline_refs) for concourse_target, pipeline_refs in self.pipelines.items() if pipeline_refs}, file, indent=2, sort_keys=True)
+    os.replace(temp_path, self.file_path)
+
+
+def find_orphans(cck_config, destroy_flag):
+  """
+  Find pipelines on concourse which cck set but no longer generates, and optionally destroy them.
+  """
+  expected_pipelines = determine_expected_pipelines(cck_config)
+  managed = ManagedPipelines(cck_config["managed_pipelines_file"])
+
+  orphans = {}
+  for concourse_target in sorted(set(expected_pipelines) | managed.targets()):
+    live_pipelines = fetch_live_pipelines(concourse_target)
+
+    #
+    # only pipelines cck has recorded setting are considered, anything else on
+    # the target was set by hand and is left alone.
+    #
+    orphans[concourse_target] = sorted(
+      pipeline_ref for pipeline_ref in live_pipelines
+      if pipeline_ref in managed.get(concourse_target)
+      and pipeline_ref not in expected_pipelines.get(concourse_target, set())
+    )
+
+  if not any(orphans.values()):
+    print(Text.green("No orphaned pipelines found."))
+    return orphans
+
+  print(Text.bold("Orphaned Pipelines - concourse-target | pipeline-name"))
+  for concourse_target, pipeline_names in orphans.items():
+    for pipeline_name in pipeline_names:
+      print(f"{concourse_target} | {Text.yellow(pipeline_name)}")
+
+  if destroy_flag:
+    print("Destroying orphaned pipelines in 10 seconds... ctl+c to cancel.")
+    try:
+      time.sleep(10)
+    except KeyboardInterrupt:
+      print(Text.yellow("Aborting!"))
+      sys.exit(0)
+    destroy_pipelines(orphans, cck_config, managed)
+
+  return orphans
+
+
+def determine_expected_pipelines(cck_config):
+  """
+  Determine every pipeline name cck would set, grouped by concourse target.
+  Every target named in concourse_targets is included, so a target is still
+  checked once the last pipeline set on it is removed.
+  """
+  expected_pipelines = {cck_config["concourse_target"]: set()}
+  for concourse_target in cck_config["concourse_targets"]:
+    expected_pipelines[concourse_target] = set()
+  for fleet_pipeline in walk_fleet(cck_config):
+    expected_pipelines.setdefault(fleet_pipeline.concourse_target, set()).add(fleet_pipeline.pipeline_ref)
+  return expected_pipelines
+
+
+FleetPipeline = collections.namedtuple("FleetPipeline", [
+  "origin_name", "environment", "module", "concourse_target", "pipeline_name", "pipeline_ref", "instance_environment"
+])
+
+
+def walk_fleet(cck_config, names=None, environments=None):
+  """
+  Yield every pipeline/environment pair cck would set, with the pipeline
+  module imported for that environment.  Nothing is rendered.
+  """
+  pipelines_dir = cck_config["pipelines_dir"]
+
+  for name in names or list_pipelines(pipelines_dir):
+    pipeline = import_pipeline(name, pipelines_dir)
+    allowed_environments = determine_pipeline_environments(pipeline, name, environments or [], pipelines_dir, cck_config["target_environments_dir"], cck_config["ignore_environments"])
+
+    for environment in sorted(allowed_environments):
+      with rendering_environment(environment):
+        importlib.reload(pipeline)
+      concourse_target = determine_concourse_target(pipeline, cck_config["concourse_target"])
+      instance_environment = environment if determine_instanced(pipeline, cck_config["instanced_pipelines"]) else None
+      pipeline_name = determine_pipeline_name(name, environment, get_pipeline_suffix(pipeline), instance_environment)
+      pipeline_ref = determine_pipeline_ref(pipeline_name, instance_environment)
+      yield FleetPipeline(name, environment, pipeline, concourse_target, pipeline_name, pipeline_ref, instance_environment)
+
+
+def render_fleet(cck_config, names=None, environments=None):
+  """
+  Yield each pipeline/environment pair with its rendered YAML text.
+  """
+  for fleet_pipeline in walk_fleet(cck_config, names, environments):
+    config_name = pipeline_config_name(fleet_pipeline.pipeline_name, fleet_pipeline.instance_environment)
+    render_pipeline(fleet_pipeline, cck_config, True)
+    with open(f"{config_name}.yml") as file:
+      rendered = file.read()
+    os.remove(f"{config_name}.yml")
+    yield fleet_pipeline, rendered
+
+
+def fetch_live_pipelines(concourse_target):
+  """
+  Fetch references to all pipelines currently set on a concourse target,
+  <name> or <name>/<var>:<value> for instanced pipelines.
+  """
+  output = fly_run(['fly', '-t', concourse_target, 'pipelines', '--json'], stdout=subprocess.PIPE)
+  if output.returncode != 0:
+    panic(f"Unable to list pipelines for concourse target: {concourse_target}")
+
+  try:
+    pipeline_refs = []
+    for pipeline in json.loads(output.stdout):
+      instance_vars = pipeline.get("instance_vars") or {}
+      instance_ref = ",".join(f"{var}:{value}" for var, value in sorted(instance_vars.items()))
+      pipeline_refs.append(f"{pipeline['name']}/{instance_ref}" if instance_ref else pipeline["name"])
+    return pipeline_refs
+  except (ValueError, TypeError, KeyError) as e:
+    panic(f"Unable to parse pipelines for concourse target: {concourse_target}", e)
+
+
+def destroy_pipelines(pipelines, cck_config, managed=None):
+  """
+  Destroy pipelines grouped by concourse target in a single rate limited pass.
+  """
+  for concourse_target, pipeline_refs in pipelines.items():
+    rate_limiter = RateLimiter(target_setting(cck_config, concourse_target, "fly_requests_per_second"))
+    for pipeline_ref in pipeline_refs:
+      rate_limiter.wait()
+      print(Text.red(f"Destroying pipeline: {pipeline_ref}"))
+      output = fly_run(['fly', '-t', concourse_target, 'destroy-pipeline', '--pipeline', pipeline_ref, '--non-interactive'])
+      if managed and output.returncode == 0: managed.forget(concourse_target, pipeline_ref)
+
+
+class RateLimiter(object):
+  """
+  Space out requests so no more than requests_per_second are made. 0 is unlimited.
+  """
+
+  def __init__(self, requests_per_second):
+    self.interval = 1.0 / requests_per_second if requests_per_second else 0
+    self.next_request = 0.0
+    self.lock = threading.Lock()
+
+  def wait(self):
+    """
+    Block until the next request is allowed.
+    """
+    if not self.interval: return
+    with self.lock:
+      now = time.monotonic()
+      request_at = max(now, self.next_request)
+      self.next_request = request_at + self.interval
+    if request_at > now: time.sleep(request_at - now)
+
+
+def determine_pipeline_name(name, environment, pipeline_suffix, instance_environment=None):
+  """
+  Determine the name a pipeline is set as on concourse i.e.
+  <env>-<name>-<suffix> or <env>-<name> when there is no suffix.
+  Instanced pipelines drop the <env>- prefix, the environment is an instance var.
+  """
+  name = name.replace("_", "-").lower()
+  if not instance_environment: name = f"{environment}-{name}"
+  if pipeline_suffix:
+    return f"{name}-{pipeline_suffix}"
+  return name
+
+
+def determine_pipeline_ref(pipeline_name, instance_environment=None):
+  """
+  The reference fly uses for a pipeline, <name>/env:<env> for an instanced pipeline.
+  """
+  if instance_environment: return f"{pipeline_name}/env:{instance_environment}"
+  return pipeline_name
+
+
+def pipeline_config_name(pipeline_name, instance_environment=None):
+  """
+  The name of the generated config file, unique per environment for instanced pipelines.
+  """
+  if instance_environment: return f"{instance_environment}-{pipeline_name}"
+  return pipeline_name
+
+
+def determine_instanced(pipeline, default_instanced):
+  """
+  Determine if a pipeline is set as one instanced pipeline per environment.
+  """
+  try:
+    instanced = pipeline.pipeline_instanced
+    if not type(instanced) == bool: return default_instanced
+  except AttributeError:
+    return default_instanced
+  return instanced
+
+
+def determine_render_concurrently(pipeline, name, pipelines_dir):
+  """
+  Determine if a pipeline opted in to rendering its environments at once,
+  which is only safe when ENVIRONMENT is read with concoursekit.env.
+  """
+  try:
+    render_concurrently = pipeline.pipeline_render_concurrently
+  except AttributeError:
+    return False
+  if render_concurrently is not True: return False
+
+  if any(value is yamlmaker or value is yamlmaker.env for value in vars(pipeline).values()):
+    panic(f"Pipeline: {pipelines_dir}/{name}.py - pipeline_render_concurrently requires reading ENVIRONMENT with concoursekit.env, not yamlmaker.env")
+  return True
+
+
+def instance_config(config, environment):
+  """
+  Replace the environment name, wherever it appears as a whole word within a
+  string value, with the ((env)) instance var.  Keys are left untouched, and
+  so are existing ((vars)) since concourse can't nest them.
+  """
+  pattern = re.compile(rf"(?<![A-Za-z0-9]){re.escape(environment)}(?![A-Za-z0-9])")
+  var_pattern = re.compile(r"(\(\([^)]*\)\))")
+
+  def substitute(value):
+    # split keeps each ((var)) at an odd index
+    parts = var_pattern.split(value)
+    return "".join(part if index % 2 else pattern.sub("((env))", part) for index, part in enumerate(parts))
+
+  def template(value):
+    if isinstance(value, ConfigNode): value = value.to_dict()
+    if type(value) is str: return substitute(value)
+    if type(value) is dict: return {key: template(item) for key, item in value.items()}
+    if type(value) in (list, tuple): return [template(item) for item in value]
+    return value
+
+  return template(config)
 
 
 def get_pipeline_suffix(pipeline):
@@ -437,10 +1690,931 @@ def fly_run(command, **kwargs):
   """
   Run the fly command.
   """
+  started = time.monotonic()
   try:
-    return subprocess.run(command, **kwargs)
+    output = subprocess.run(command, **kwargs)
   except FileNotFoundError:
     panic("Unable to Execute Fly Command. Is it Installed?")
+  METRICS.fly_call(command, time.monotonic() - started, output.returncode)
+  return output
+
+
+class RunMetrics(object):
+  """
+  Measurements taken during one cck run, written as an OpenMetrics textfile
+  and a JSON lines event stream when the run ends.
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.clear()
+
+  def clear(self):
+    self.started = time.time()
+    self.renders = {}  # (pipeline, environment) -> (seconds, bytes, cached)
+    self.fly_calls = {}  # (target, command) -> [count, seconds, failures]
+    self.validation_failures = collections.Counter()
+    self.outcomes = collections.Counter()
+    self.events = []
+
+  def event(self, event, **fields):
+    self.events.append({"time": round(time.time(), 3), "event": event, **fields})
+
+  def render(self, pipeline, environment, seconds, size, cached=False):
+    with self.lock:
+      self.renders[(pipeline, environment)] = (seconds, size, cached)
+      self.event("render", pipeline=pipeline, environment=environment, seconds=round(seconds, 6), bytes=size, cached=cached)
+
+  def fly_call(self, command, seconds, returncode):
+    """
+    Record a fly call by its target, given by -t, and its subcommand.
+    """
+    arguments = list(command[1:])
+    target = ""
+    if "-t" in arguments:
+      index = arguments.index("-t")
+      target = arguments[index + 1] if index + 1 < len(arguments) else ""
+      del arguments[index:index + 2]
+    subcommand = arguments[0] if arguments else ""
+
+    with self.lock:
+      calls = self.fly_calls.setdefault((target, subcommand), [0, 0.0, 0])
+      calls[0] += 1
+      calls[1] += seconds
+      if returncode: calls[2] += 1
+      self.event("fly", target=target, command=subcommand, seconds=round(seconds, 6), returncode=returncode)
+
+      if subcommand == "validate-pipeline" and returncode:
+        config_file = arguments[arguments.index("--config") + 1] if "--config" in arguments[:-1] else ""
+        pipeline = os.path.splitext(os.path.basename(config_file))[0]
+        self.validation_failures[pipeline] += 1
+        self.event("validation_failure", pipeline=pipeline)
+
+  def outcome(self, outcome, pipeline_ref):
+    """
+    Record whether a pipeline was set, failed to set, or skipped.
+    """
+    with self.lock:
+      self.outcomes[outcome] += 1
+      self.event("pipeline", pipeline=pipeline_ref, outcome=outcome)
+
+  def openmetrics(self):
+    """
+    Render every measurement in the OpenMetrics text format.
+    """
+    def labels(**values):
+      escaped = [(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in values.items()]
+      return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+    def family(name, metric_type, help_text, samples):
+      lines.append(f"# TYPE {name} {metric_type}")
+      lines.append(f"# HELP {name} {help_text}")
+      lines.extend(f"{sample_name}{sample_labels} {value}" for sample_name, sample_labels, value in samples)
+
+    with self.lock:
+      lines = []
+      renders = sorted(self.renders.items())
+      fly_calls = sorted(self.fly_calls.items())
+      family("cck_render_duration_seconds", "gauge", "Time taken to render a pipeline environment.", [
+        ("cck_render_duration_seconds", labels(pipeline=pipeline, environment=environment, cached=str(cached).lower()), f"{seconds:.6f}")
+        for (pipeline, environment), (seconds, size, cached) in renders
+      ])
+      family("cck_render_yaml_bytes", "gauge", "Size of a rendered pipeline environment.", [
+        ("cck_render_yaml_bytes", labels(pipeline=pipeline, environment=environment), size)
+        for (pipeline, environment), (seconds, size, cached) in renders
+      ])
+      family("cck_fly_calls", "counter", "fly calls made, by concourse target and command.", [
+        ("cck_fly_calls_total", labels(target=target, command=command), count)
+        for (target, command), (count, seconds, failures) in fly_calls
+      ])
+      family("cck_fly_call_failures", "counter", "fly calls which exited non-zero, by concourse target and command.", [
+        ("cck_fly_call_failures_total", labels(target=target, command=command), failures)
+        for (target, command), (count, seconds, failures) in fly_calls
+      ])
+      family("cck_fly_call_duration_seconds", "summary", "Latency of fly calls, by concourse target and command.", [
+        sample for (target, command), (count, seconds, failures) in fly_calls for sample in [
+          ("cck_fly_call_duration_seconds_count", labels(target=target, command=command), count),
+          ("cck_fly_call_duration_seconds_sum", labels(target=target, command=command), f"{seconds:.6f}")
+        ]
+      ])
+      family("cck_validation_failures", "counter", "Pipelines which failed fly validate-pipeline.", [
+        ("cck_validation_failures_total", labels(pipeline=pipeline), count)
+        for pipeline, count in sorted(self.validation_failures.items())
+      ])
+      family("cck_pipelines", "counter", "Pipelines set, failed to set or skipped.", [
+        ("cck_pipelines_total", labels(outcome=outcome), self.outcomes[outcome])
+        for outcome in ["set", "failed", "skipped"]
+      ])
+      family("cck_run_duration_seconds", "gauge", "Time taken by the whole cck run.", [
+        ("cck_run_duration_seconds", "", f"{time.time() - self.started:.3f}")
+      ])
+      family("cck_run_start_seconds", "gauge", "When the cck run started, as a unix timestamp.", [
+        ("cck_run_start_seconds", "", f"{self.started:.3f}")
+      ])
+      lines.append("# EOF")
+      return "\n".join(lines) + "\n"
+
+  def write(self, metrics_file, events_file):
+    """
+    Atomically write the metrics textfile and the event stream, when configured.
+    """
+    if metrics_file:
+      text = self.openmetrics()
+      with open(f"{metrics_file}.tmp", "w") as file:
+        file.write(text)
+      os.replace(f"{metrics_file}.tmp", metrics_file)
+    if events_file:
+      with self.lock:
+        events = list(self.events)
+      with open(f"{events_file}.tmp", "w") as file:
+        for event in events:
+          file.write(json.dumps(event, sort_keys=True) + "\n")
+      os.replace(f"{events_file}.tmp", events_file)
+
+
+METRICS = RunMetrics()
+
+class ConfigNode(object):
+  """
+  Base class for the typed pipeline config builders.
+
+  Nodes are immutable and use __slots__ so large, fan-out pipelines take far
+  less memory than the equivalent nested dictionaries.  Commonly repeated
+  strings (resource types, platforms etc.) are interned, lists are stored as
+  tuples and the digest and hash are computed once and cached.  The serialized
+  dictionary is built on demand and never kept, so a node tree held for the
+  whole run, i.e. by a fragment, stays compact.  Any key without a dedicated
+  field can be passed through extra={...}.
+  """
+  __slots__ = ("extra", "_digest")
+  fields = ()
+  interned = ()
+
+  def __init__(self, *args, extra=None, **kwargs):
+    if len(args) > len(self.fields):
+      raise TypeError(f"{type(self).__name__} takes at most {len(self.fields)} positional arguments")
+    kwargs |= dict(zip(self.fields, args))
+
+    unknown = set(kwargs) - set(self.fields)
+    if unknown:
+      raise TypeError(f"{type(self).__name__} got unexpected field(s): {', '.join(sorted(unknown))}")
+
+    for field in self.fields:
+      value = kwargs.get(field)
+      if field in self.interned and type(value) is str: value = sys.intern(value)
+      object.__setattr__(self, field, compact_value(value))
+    object.__setattr__(self, "extra", extra)
+    object.__setattr__(self, "_digest", None)
+
+  def __setattr__(self, name, value):
+    raise AttributeError(f"{type(self).__name__} is immutable, use replace() to change {name}")
+
+  def replace(self, **changes):
+    """
+    Return a copy of this node with some fields changed.
+    """
+    fields = {field: getattr(self, field) for field in self.fields}
+    return type(self)(extra=changes.pop("extra", self.extra), **(fields | changes))
+
+  def to_dict(self):
+    """
+    Serialize to the plain dictionary form pipeline_config() returns.
+    """
+    config = {}
+    for field in self.fields:
+      value = getattr(self, field)
+      if value is not None: config[field] = plain_value(value)
+    if self.extra: config |= plain_value(self.extra)
+    return config
+
+  def digest(self):
+    """
+    A stable sha256 digest of the serialized node.
+    """
+    if self._digest is None:
+      canonical = json.dumps(self.to_dict(), sort_keys=True, separators=(",", ":"), default=str)
+      object.__setattr__(self, "_digest", hashlib.sha256(canonical.encode()).hexdigest())
+    return self._digest
+
+  def __eq__(self, other):
+    if type(self) is not type(other): return NotImplemented
+    return self.digest() == other.digest()
+
+  def __hash__(self):
+    return hash(self.digest())
+
+  def __repr__(self):
+    return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+def compact_value(value):
+  """
+  Store lists as tuples within a node field.
+  """
+  if type(value) is list: return tuple(compact_value(item) for item in value)
+  return value
+
+
+def plain_value(value):
+  """
+  Convert nodes and tuples back into plain dictionaries and lists.
+  """
+  if isinstance(value, ConfigNode): return value.to_dict()
+  if type(value) in (list, tuple): return [plain_value(item) for item in value]
+  if type(value) is dict: return {key: plain_value(item) for key, item in value.items()}
+  return value
+
+
+class Pipeline(ConfigNode):
+  """
+  A whole pipeline, may be returned from pipeline_config() in place of a dictionary.
+  """
+  fields = ("jobs", "resources", "resource_types", "groups", "display", "var_sources")
+  __slots__ = fields
+
+
+class Job(ConfigNode):
+  fields = ("name", "plan", "serial", "serial_groups", "max_in_flight", "public")
+  __slots__ = fields
+
+
+class Resource(ConfigNode):
+  fields = ("name", "type", "source", "check_every", "icon", "tags", "webhook_token")
+  interned = ("type", "check_every", "icon")
+  __slots__ = fields
+
+
+class ResourceType(ConfigNode):
+  fields = ("name", "type", "source", "check_every", "privileged", "defaults")
+  interned = ("type", "check_every")
+  __slots__ = fields
+
+
+class Get(ConfigNode):
+  fields = ("get", "resource", "passed", "trigger", "params")
+  interned = ("get", "resource")
+  __slots__ = fields
+
+
+class Put(ConfigNode):
+  fields = ("put", "resource", "inputs", "params", "get_params")
+  interned = ("put", "resource")
+  __slots__ = fields
+
+
+class Task(ConfigNode):
+  fields = ("task", "config", "file", "image", "privileged", "params", "input_mapping", "output_mapping")
+  interned = ("file", "image")
+  __slots__ = fields
+
+
+class TaskConfig(ConfigNode):
+  fields = ("platform", "image_resource", "inputs", "outputs", "params", "run")
+  interned = ("platform",)
+  __slots__ = fields
+
+
+# nodes nested within plain dictionaries are serialized as their dictionary form
+yaml.SafeDumper.add_multi_representer(ConfigNode, lambda dumper, node: dumper.represent_dict(node.to_dict()))
+
+
+class FragmentCache(object):
+  """
+  Values built by @fragment helpers, shared across every environment and
+  pipeline generated within one cck run, along with their serialized form.
+  """
+
+  def __init__(self):
+    self.values = {}
+    self.ids = {}
+    self.nodes = {}
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.RLock()
+
+  def get(self, key, build):
+    """
+    Return the cached value for key, building it on the first request.
+    """
+    with self.lock:
+      if key in self.values:
+        self.hits += 1
+      else:
+        self.misses += 1
+        value = build()
+        self.values[key] = value
+        self.ids[id(value)] = value
+      return self.values[key]
+
+  def is_fragment(self, value):
+    """
+    Whether a value was produced by a fragment, checked by identity.
+    """
+    return id(value) in self.ids
+
+  def clear(self):
+    self.values.clear()
+    self.ids.clear()
+    self.nodes.clear()
+    self.hits = 0
+    self.misses = 0
+
+
+FRAGMENTS = FragmentCache()
+
+
+def fragment(function):
+  """
+  Decorator which memoizes a pipeline helper by its arguments for the whole run.
+
+  The returned value is shared by every caller, treat it as read-only.  Any
+  environment specific input must be passed as an argument, as the cache is
+  not keyed by ENVIRONMENT.  Calls with unhashable arguments are not cached.
+  """
+  @functools.wraps(function)
+  def wrapper(*args, **kwargs):
+    key = (function.__module__, function.__qualname__, args, tuple(sorted(kwargs.items())))
+    try:
+      hash(key)
+    except TypeError:
+      return function(*args, **kwargs)
+    return FRAGMENTS.get(key, lambda: function(*args, **kwargs))
+  return wrapper
+
+
+class FragmentDumper(yaml.SafeDumper):
+  """
+  Dumper which represents each fragment once per run and reuses the node, so
+  a fragment repeated within a document is emitted as an anchor and aliases
+  rather than being walked and serialized again.
+  """
+
+  def ignore_aliases(self, data):
+    return True
+
+  def represent_data(self, data):
+    if FRAGMENTS.is_fragment(data):
+      node = FRAGMENTS.nodes.get(id(data))
+      if node is None:
+        node = super().represent_data(data)
+        FRAGMENTS.nodes[id(data)] = node
+      return node
+    return super().represent_data(data)
+
+
+def represent_multiline_str(dumper, data):
+  if "\n" in data:
+    return dumper.represent_scalar("tag:yaml.org,2002:str", data, style="|")
+  return yaml.SafeDumper.represent_str(dumper, data)
+
+
+FragmentDumper.add_representer(str, represent_multiline_str)
+
+
+def analyze_pipelines(name, environments, cck_config):
+  """
+  Estimate the load each rendered pipeline puts on the ATC and flag the outliers.
+  """
+  outlier_factor = cck_config["analysis_outlier_factor"]
+  analyses = []
+  for fleet_pipeline, rendered in render_fleet(cck_config, [name] if name else None, environments):
+    analysis = analyze_config(yaml.safe_load(rendered) or {})
+    analysis["size_bytes"] = len(rendered.encode())
+    analyses.append((fleet_pipeline, analysis))
+
+  metrics = ["resources", "checks_per_hour", "jobs", "tasks", "passed_fan_in", "size_bytes"]
+
+  #
+  # a pipeline is an outlier for a metric when it is outlier_factor times the median
+  #
+  medians = {}
+  for metric in metrics:
+    values = sorted(analysis[metric] for _, analysis in analyses)
+    medians[metric] = values[len(values) // 2] if values else 0
+
+  def is_outlier(metric, value):
+    return len(analyses) > 2 and medians[metric] > 0 and value > medians[metric] * outlier_factor
+
+  print(Text.bold("Pipeline Load - pipeline-name | concourse-target | resources | checks/hour | jobs | tasks | passed fan-in | size"))
+  outliers = []
+  for fleet_pipeline, analysis in analyses:
+    columns = []
+    for metric in metrics:
+      value = round(analysis[metric], 1) if metric == "checks_per_hour" else analysis[metric]
+      if is_outlier(metric, analysis[metric]):
+        columns.append(Text.yellow(value))
+        outliers.append((fleet_pipeline.pipeline_ref, metric))
+      else:
+        columns.append(str(value))
+    print(f"{fleet_pipeline.pipeline_ref} | {fleet_pipeline.concourse_target} | {' | '.join(columns)}")
+
+  targets = {}
+  for fleet_pipeline, analysis in analyses:
+    totals = targets.setdefault(fleet_pipeline.concourse_target, dict.fromkeys(["pipelines"] + metrics, 0))
+    totals["pipelines"] += 1
+    for metric in metrics: totals[metric] += analysis[metric]
+
+  print(Text.bold("Target Load - concourse-target | pipelines | resources | checks/hour | jobs | tasks | passed fan-in | size"))
+  for concourse_target, totals in sorted(targets.items()):
+    totals["checks_per_hour"] = round(totals["checks_per_hour"], 1)
+    print(f"{concourse_target} | {' | '.join(str(totals[metric]) for metric in ['pipelines'] + metrics)}")
+
+  for pipeline_ref, metric in outliers:
+    print(Text.yellow(f"Outlier - {pipeline_ref}: {metric} is over {outlier_factor}x the median of {medians[metric]}"))
+
+  return analyses
+
+
+def analyze_config(config):
+  """
+  Count what drives ATC load within a single rendered pipeline config.
+  """
+  resources = config.get("resources") or []
+  resource_types = config.get("resource_types") or []
+  jobs = config.get("jobs") or []
+
+  # resource types are checked just like resources
+  checks_per_hour = 0.0
+  for resource in resources + resource_types:
+    interval = parse_duration(resource.get("check_every", "1m"))
+    if interval: checks_per_hour += 3600 / interval
+
+  steps = [step for job in jobs for step in walk_steps(job)]
+  return {
+    "resources": len(resources),
+    "checks_per_hour": checks_per_hour,
+    "jobs": len(jobs),
+    "tasks": sum(1 for step in steps if "task" in step),
+    "passed_fan_in": sum(len(step.get("passed") or []) for step in steps if "get" in step),
+  }
+
+
+def walk_steps(step):
+  """
+  Yield every step within a job or step, including nested and hook steps.
+  """
+  if type(step) is not dict: return
+  if "plan" not in step: yield step
+
+  for key in ["plan", "do", "in_parallel", "aggregate", "steps", "try", "on_success", "on_failure", "on_error", "on_abort", "ensure"]:
+    nested = step.get(key)
+    if type(nested) is list:
+      for nested_step in nested: yield from walk_steps(nested_step)
+    elif type(nested) is dict:
+      # in_parallel may be {steps: [...]} rather than a list
+      if key == "in_parallel": yield from walk_steps({"steps": nested.get("steps")})
+      else: yield from walk_steps(nested)
+
+
+def parse_duration(duration):
+  """
+  Parse a Go style duration, i.e. 1h30m or 30s, into seconds.  never is 0.
+  """
+  if duration == "never": return 0
+  parts = re.findall(r"(\d+(?:\.\d+)?)(ns|us|µs|ms|s|m|h)", str(duration))
+  if not parts:
+    print(Text.yellow(f"Warning - Unable to parse duration: {duration}, assuming 1m"))
+    return 60
+  units = {"ns": 1e-9, "us": 1e-6, "µs": 1e-6, "ms": 1e-3, "s": 1, "m": 60, "h": 3600}
+  return sum(float(value) * units[unit] for value, unit in parts)
+
+
+def find_duplicate_resources(name, environments, cck_config):
+  """
+  Report resources declared with the exact same type and source more than
+  once across the rendered fleet, each copy is checked independently.
+  """
+  index = {}
+  for fleet_pipeline, rendered in render_fleet(cck_config, [name] if name else None, environments):
+    config = yaml.safe_load(rendered) or {}
+    for resource in config.get("resources") or []:
+      index.setdefault(resource_digest(resource), []).append((fleet_pipeline, resource))
+
+  duplicates = {digest: copies for digest, copies in index.items() if len(copies) > 1}
+  if not duplicates:
+    print(Text.green("No duplicate resources found."))
+    return duplicates
+
+  print(Text.bold("Duplicate Resources - pipeline-name | concourse-target | resource | check_every"))
+  redundant_checks = 0.0
+  for digest, copies in sorted(duplicates.items(), key=lambda item: -len(item[1])):
+    resource_type = copies[0][1].get("type")
+    print(Text.cyan(f"{resource_type} {digest[:12]} - declared {len(copies)} times"))
+    checks = []
+    for fleet_pipeline, resource in copies:
+      check_every = resource.get("check_every", "1m")
+      interval = parse_duration(check_every)
+      checks.append(3600 / interval if interval else 0)
+      print(f"  {fleet_pipeline.pipeline_ref} | {fleet_pipeline.concourse_target} | {resource.get('name')} | {check_every}")
+    # one copy has to keep checking, the rest are redundant
+    redundant_checks += sum(checks) - max(checks)
+
+  print(Text.yellow(f"Up to {round(redundant_checks, 1)} checks/hour are redundant."))
+  print("Recommendations:")
+  print("  - Enable global resources on the ATC so identical resources share a single check.")
+  print("  - Otherwise, keep one copy checking and give the rest a webhook_token with check_every: never.")
+  print("  - Set dedupe_resources: true to merge identical resources within the same pipeline.")
+
+  return duplicates
+
+
+def resource_digest(resource, fields=("type", "source")):
+  """
+  A canonical digest of a resource's type and source, or the given fields.
+  """
+  canonical = json.dumps({field: resource.get(field) for field in fields}, sort_keys=True, separators=(",", ":"), default=str)
+  return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+# resources differing in any of these behave differently, and are never merged
+DEDUPE_RESOURCE_FIELDS = ("type", "source", "tags", "webhook_token", "version")
+
+
+def dedupe_resources(config):
+  """
+  Merge resources with the same type, source, tags, webhook_token and
+  version within a pipeline config into the first one declared, which keeps
+  the slowest check_every of those merged.  Steps keep their names and point
+  at the kept resource with resource:, so nothing else in the pipeline changes.
+  """
+  if isinstance(config, ConfigNode): config = config.to_dict()
+
+  kept = {}
+  renamed = {}
+  check_every = {}
+  for resource in config.get("resources") or []:
+    digest = resource_digest(resource, DEDUPE_RESOURCE_FIELDS)
+    if digest in kept:
+      renamed[resource.get("name")] = kept[digest]
+    else:
+      kept[digest] = resource.get("name")
+    check_every.setdefault(kept[digest], []).append(resource.get("check_every", "1m"))
+
+  if not renamed: return config
+
+  def check_interval(duration):
+    return float("inf") if duration == "never" else parse_duration(duration)
+
+  # the config may share fragments with other pipelines, never modify it in place
+  config = plain_value(config)
+  config["resources"] = [resource for resource in config["resources"] if resource.get("name") not in renamed]
+  for resource in config["resources"]:
+    slowest = max(check_every[resource.get("name")], key=check_interval)
+    if check_interval(slowest) > check_interval(resource.get("check_every", "1m")): resource["check_every"] = slowest
+  for job in config.get("jobs") or []:
+    for step in walk_steps(job):
+      for step_type in ["get", "put"]:
+        if step_type not in step: continue
+        resource_name = step.get("resource", step[step_type])
+        if resource_name in renamed: step["resource"] = renamed[resource_name]
+
+  return config
+
+
+def serve(cck_config):
+  """
+  Keep pipeline modules, caches and fragments loaded and answer render, plan
+  and validate requests from cck --client over a local unix socket.
+  """
+  if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+    panic("cck --serve requires unix socket support.")
+
+  socket_path = cck_config["server_socket"]
+  if os.path.exists(socket_path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+      if connection.connect_ex(socket_path) == 0:
+        panic(f"cck is already serving on {socket_path}")
+    os.remove(socket_path)  # left behind by a server which did not shut down cleanly
+
+  server = RenderServer(socket_path, cck_config)
+  print(Text.green(f"Serving on {socket_path}... ctl+c to stop."))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    print(Text.yellow("Stopping!"))
+  finally:
+    server.server_close()
+    if os.path.exists(socket_path): os.remove(socket_path)
+
+
+class RenderServer(getattr(socketserver, "ThreadingUnixStreamServer", object)):
+  """
+  Unix socket server which handles one request at a time, as rendering
+  depends on the process wide ENVIRONMENT and working directory.
+  """
+  daemon_threads = True
+
+  def __init__(self, socket_path, cck_config):
+    super().__init__(socket_path, RenderRequestHandler)
+    self.cck_config = cck_config
+    self.lock = threading.Lock()
+    self.module_mtimes = local_module_mtimes()
+
+
+class RenderRequestHandler(socketserver.StreamRequestHandler):
+  """
+  Each request and response is a single line of JSON.
+  """
+
+  def handle(self):
+    try:
+      request = json.loads(self.rfile.readline())
+    except ValueError:
+      response = {"ok": False, "output": "Invalid request, expected a single line of JSON."}
+    else:
+      with self.server.lock:
+        response = handle_request(request, self.server)
+    self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+def handle_request(request, server):
+  """
+  Run a render, plan or validate request and capture everything it prints.
+  """
+  cck_config = server.cck_config
+  command = request.get("command")
+  name = request.get("name")
+  environments = request.get("environments") or []
+
+  #
+  # pick up any edits made since the last request
+  #
+  module_mtimes = local_module_mtimes()
+  changed = [module_name for module_name, mtime in module_mtimes.items() if server.module_mtimes.get(module_name) != mtime]
+  for module_name in changed:
+    if module_name in sys.modules: importlib.reload(sys.modules[module_name])
+  if changed: FRAGMENTS.clear()
+  server.module_mtimes = module_mtimes
+
+  # each request is measured and written out as a run of its own
+  METRICS.clear()
+  response = {"ok": True, "files": {}, "valid": {}}
+  output = io.StringIO()
+  try:
+    with contextlib.redirect_stdout(output):
+      if command == "render":
+        for fleet_pipeline, rendered in render_fleet(cck_config, [name] if name else None, environments):
+          response["files"][pipeline_config_name(fleet_pipeline.pipeline_name, fleet_pipeline.instance_environment)] = rendered
+      elif command == "plan":
+        if name: set_pipeline(name, environments, False, cck_config, True)
+        else: set_pipelines(environments, True, cck_config, True)
+      elif command == "validate":
+        for fleet_pipeline, rendered in render_fleet(cck_config, [name] if name else None, environments):
+          config_name = pipeline_config_name(fleet_pipeline.pipeline_name, fleet_pipeline.instance_environment)
+          with open(f"{config_name}.yml", "w") as file:
+            file.write(rendered)
+          validation = fly_run(['fly', 'validate-pipeline', '--config', f"{config_name}.yml"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+          os.remove(f"{config_name}.yml")
+          response["valid"][fleet_pipeline.pipeline_ref] = validation.returncode == 0
+          if validation.returncode != 0: print(validation.stdout.decode() if validation.stdout else "")
+        response["ok"] = all(response["valid"].values())
+      else:
+        panic(f"Unknown request: {command}")
+  except SystemExit:
+    response["ok"] = False
+  except RenderLimitExceeded as e:
+    response["ok"] = False
+    output.write(f"Pipeline render exceeded its limits: {e}\n")
+  except Exception:
+    response["ok"] = False
+    output.write(traceback.format_exc())
+
+  response["output"] = output.getvalue()
+  METRICS.write(cck_config["metrics_file"], cck_config["events_file"])
+  return response
+
+
+def local_module_mtimes():
+  """
+  The modification times of every loaded module from within the current directory.
+  """
+  cwd = os.path.realpath(os.getcwd())
+  mtimes = {}
+  for module_name, module in list(sys.modules.items()):
+    module_file = getattr(module, "__file__", None)
+    if not module_file or module_name == __name__: continue
+    module_file = os.path.realpath(module_file)
+    if module_file.startswith(cwd + os.sep) and "site-packages" not in module_file and os.path.exists(module_file):
+      mtimes[module_name] = os.path.getmtime(module_file)
+  return mtimes
+
+
+def client_request(command, name, environments, cck_config):
+  """
+  Send a request to a running cck --serve and write out its response.
+  """
+  socket_path = cck_config["server_socket"]
+  request = {"command": command, "name": name, "environments": environments}
+  try:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+      connection.connect(socket_path)
+      connection.sendall(json.dumps(request).encode() + b"\n")
+      with connection.makefile("rb") as stream:
+        response = json.loads(stream.readline())
+  except (OSError, ValueError) as e:
+    panic(f"Unable to reach cck --serve on {socket_path}", e)
+
+  if response["output"]: print(response["output"], end="")
+  for config_name, rendered in response.get("files", {}).items():
+    print(Text.blue(f"Generating Pipeline to {config_name}.yml"))
+    with open(f"{config_name}.yml", "w") as file:
+      file.write(rendered)
+  for pipeline_ref, valid in response.get("valid", {}).items():
+    print(f"{pipeline_ref} | {Text.green('valid') if valid else Text.red('invalid')}")
+
+  if not response["ok"]: sys.exit(1)
+  return response
+
+
+VARS_BUNDLE_MAGIC = b"CCKVARS1"
+VARS_BUNDLE_HEADER = struct.Struct("<8sQQ")  # magic, index offset, index length
+
+
+def compile_vars(cck_config):
+  """
+  Read every file under the target environments once and write them to a
+  vars bundle.  YAML files are stored parsed, as JSON, alongside their text.
+  """
+  target_environments_dir = cck_config["target_environments_dir"]
+  bundle_path = cck_config["vars_bundle"]
+
+  index = {}
+  temp_path = f"{bundle_path}.tmp"
+  with open(temp_path, "wb") as bundle:
+    bundle.write(VARS_BUNDLE_HEADER.pack(VARS_BUNDLE_MAGIC, 0, 0))
+
+    def write(data):
+      offset = bundle.tell()
+      bundle.write(data)
+      return [offset, len(data)]
+
+    for root, dirs, files in os.walk(target_environments_dir):
+      dirs.sort()
+      for file_name in sorted(files):
+        file_path = os.path.normpath(os.path.join(root, file_name))
+        with open(file_path, "rb") as file:
+          content = file.read()
+        try:
+          text = content.decode()
+        except UnicodeDecodeError:
+          continue  # Files only reads text
+
+        stat = os.stat(file_path)
+        entry = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": hashlib.sha256(content).hexdigest()}
+        entry["text"] = write(text.replace("\r\n", "\n").replace("\r", "\n").encode())  # as read in text mode
+
+        #
+        # only data which survives a round trip through JSON is stored parsed,
+        # anything else such as dates or integer keys is parsed at render time
+        #
+        if file_name.endswith((".yml", ".yaml")):
+          try:
+            data = yaml.load(text, Loader=yaml.FullLoader)
+            encoded = json.dumps(data, separators=(",", ":"))
+            if json.loads(encoded) == data: entry["data"] = write(encoded.encode())
+          except (yaml.YAMLError, TypeError, ValueError):
+            pass
+
+        index[file_path] = entry
+
+    index_offset, index_length = write(json.dumps(index, sort_keys=True).encode())
+    bundle.seek(0)
+    bundle.write(VARS_BUNDLE_HEADER.pack(VARS_BUNDLE_MAGIC, index_offset, index_length))
+  os.replace(temp_path, bundle_path)
+
+  parsed = sum(1 for entry in index.values() if "data" in entry)
+  print(Text.green(f"Compiled {len(index)} files, {parsed} parsed, from {target_environments_dir} to {bundle_path}"))
+  return index
+
+
+class VarsBundle(object):
+  """
+  Read only, memory mapped view of a bundle written by cck --compile-vars.
+  Entries whose file has changed since compiling are treated as missing.
+  Raises ValueError when the file is not a bundle this version can read.
+  """
+
+  def __init__(self, bundle_path):
+    self.bundle_path = bundle_path
+    if os.path.getsize(bundle_path) < VARS_BUNDLE_HEADER.size:
+      raise ValueError("is too short")
+    with open(bundle_path, "rb") as file:
+      self.mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, index_offset, index_length = VARS_BUNDLE_HEADER.unpack_from(self.mapped)
+    if magic != VARS_BUNDLE_MAGIC:
+      self.mapped.close()
+      raise ValueError("has the wrong magic, it is corrupt or from another version of cck")
+    try:
+      self.index = json.loads(self.mapped[index_offset:index_offset + index_length])
+    except ValueError:
+      self.mapped.close()
+      raise ValueError("has a corrupt index")
+    self.fresh = {}
+    self.lock = threading.Lock()
+
+  def entry(self, file_path):
+    """
+    The index entry for a file, or None when it is not bundled or is stale.
+    A file whose mtime or size changed, i.e. by a fresh checkout, is still
+    used when its contents hash the same.
+    """
+    file_path = os.path.normpath(os.path.relpath(file_path) if os.path.isabs(file_path) else file_path)
+    entry = self.index.get(file_path)
+    if entry is None: return None
+
+    try:
+      stat = os.stat(file_path)
+    except OSError:
+      return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    with self.lock:
+      if self.fresh.get(file_path) == signature: return entry
+    if signature != (entry["mtime_ns"], entry["size"]):
+      if stat.st_size != entry["size"] or hash_file(file_path) != entry["sha256"]: return None
+    with self.lock:
+      self.fresh[file_path] = signature
+    return entry
+
+  def read(self, location):
+    offset, length = location
+    return self.mapped[offset:offset + length]
+
+  def data(self, file_path):
+    """
+    Return (True, parsed data) for a bundled YAML file, or (False, None).
+    """
+    entry = self.entry(file_path)
+    if entry is None or "data" not in entry: return False, None
+    return True, json.loads(self.read(entry["data"]))
+
+  def text(self, file_path):
+    """
+    Return the text of a bundled file, or None.
+    """
+    entry = self.entry(file_path)
+    if entry is None: return None
+    return self.read(entry["text"]).decode()
+
+
+VARS_BUNDLE = None
+
+
+def use_vars_bundle(bundle_path):
+  """
+  Read vars through the bundle at bundle_path when it exists, otherwise stop using one.
+  A bundle which cannot be read is ignored, and vars are read from their files.
+  """
+  global VARS_BUNDLE
+  VARS_BUNDLE = None
+  if bundle_path and os.path.exists(bundle_path):
+    try:
+      VARS_BUNDLE = VarsBundle(bundle_path)
+    except ValueError as e:
+      print(Text.yellow(f"Warning - Vars Bundle: {bundle_path} {e} and will not be used, run cck --compile-vars to rebuild it."))
+  return VARS_BUNDLE
+
+
+class Sources(yamlmaker.Sources):
+  """
+  yamlmaker.Sources which reads parsed var files from the vars bundle, and
+  parses any file which is not bundled or has changed since.
+  """
+
+  def __init__(self, sources):
+    bundled = {}
+    unbundled = {}
+    for source_label, file_path in sources.items():
+      found, data = VARS_BUNDLE.data(file_path) if VARS_BUNDLE else (False, None)
+      if found:
+        bundled[source_label] = {"data": data, "file_path": file_path}
+      else:
+        unbundled[source_label] = file_path
+
+    super().__init__(unbundled)
+    self.source_map.update(bundled)
+
+
+class Files(yamlmaker.Files):
+  """
+  yamlmaker.Files which reads file contents from the vars bundle, and reads
+  any file which is not bundled or has changed since.
+  """
+
+  def __init__(self, files):
+    bundled = {}
+    unbundled = {}
+    for file_label, file_path in files.items():
+      text = VARS_BUNDLE.text(file_path) if VARS_BUNDLE else None
+      if text is not None:
+        bundled[file_label] = {"text": text, "file_path": file_path}
+      else:
+        unbundled[file_label] = file_path
+
+    super().__init__(unbundled)
+    self.file_map.update(bundled)
+
 
 if __name__ == "__main__":
   main()
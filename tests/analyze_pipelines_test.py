@@ -0,0 +1,52 @@
+from concoursekit import analyze_config
+from concoursekit import analyze_pipelines
+from concoursekit import parse_duration
+from concoursekit import load_config
+
+
+def test_parse_duration():
+  assert parse_duration("1m") == 60
+  assert parse_duration("1h30m") == 5400
+  assert parse_duration("500ms") == 0.5
+  assert parse_duration("never") == 0
+
+
+def test_analyze_config():
+  config = {
+    "resource_types": [{"name": "slack", "type": "registry-image"}],
+    "resources": [
+      {"name": "repo", "type": "git", "check_every": "30s"},
+      {"name": "image", "type": "registry-image", "check_every": "never"},
+    ],
+    "jobs": [
+      {"name": "build", "plan": [{"get": "repo", "trigger": True}, {"task": "unit"}]},
+      {
+        "name": "deploy",
+        "plan": [
+          {"in_parallel": [{"get": "repo", "passed": ["build"]}, {"get": "image"}]},
+          {"do": [{"task": "deploy"}, {"task": "smoke"}]},
+        ],
+        "on_failure": {"task": "notify"},
+      },
+    ],
+  }
+
+  assert analyze_config(config) == {
+    "resources": 2,
+    "checks_per_hour": 120 + 60,
+    "jobs": 2,
+    "tasks": 4,
+    "passed_fan_in": 1,
+  }
+
+
+def test_analyze_pipelines(capsys):
+  cck_config = load_config()
+
+  analyses = analyze_pipelines(None, ["dev"], cck_config)
+
+  out, err = capsys.readouterr()
+  assert [fleet_pipeline.pipeline_ref for fleet_pipeline, _ in analyses] == ["dev-bar-mgmt", "dev-baz-mgmt", "dev-foo-mgmt-install", "dev-zoo-mgmt-install-dev"]
+  assert analyses[2][1]["tasks"] == 2
+  assert "Target Load" in out
+  assert "my-team | 2 |" in out
@@ -0,0 +1,70 @@
+from unittest.mock import patch
+import yaml
+from concoursekit import dedupe_resources
+from concoursekit import find_duplicate_resources
+from concoursekit import load_config
+from concoursekit import FleetPipeline
+
+
+REPO = {"type": "git", "source": {"uri": "https://example.com/repo.git", "branch": "main"}}
+
+
+def test_dedupe_resources():
+  config = {
+    "resources": [
+      {"name": "repo", **REPO},
+      {"name": "repo-copy", "check_every": "5m", **REPO},
+      {"name": "other", "type": "git", "source": {"uri": "https://example.com/other.git"}},
+    ],
+    "jobs": [
+      {"name": "build", "plan": [{"in_parallel": [{"get": "repo-copy", "trigger": True}, {"get": "other"}]}]},
+      {"name": "push", "plan": [{"put": "out", "resource": "repo-copy"}]},
+    ],
+  }
+
+  deduped = dedupe_resources(config)
+
+  assert [resource["name"] for resource in deduped["resources"]] == ["repo", "other"]
+  assert deduped["jobs"][0]["plan"][0]["in_parallel"][0] == {"get": "repo-copy", "trigger": True, "resource": "repo"}
+  assert deduped["jobs"][0]["plan"][0]["in_parallel"][1] == {"get": "other"}
+  assert deduped["jobs"][1]["plan"][0] == {"put": "out", "resource": "repo"}
+  # the slowest check_every of those merged is kept
+  assert deduped["resources"][0]["check_every"] == "5m"
+  # the original config is left untouched
+  assert len(config["resources"]) == 3
+  assert "check_every" not in config["resources"][0]
+
+
+def test_dedupe_keeps_resources_which_behave_differently():
+  config = {
+    "resources": [
+      {"name": "repo", **REPO},
+      {"name": "repo-tagged", "tags": ["private"], **REPO},
+      {"name": "repo-webhook", "webhook_token": "secret", **REPO},
+      {"name": "repo-pinned", "version": {"ref": "abc123"}, **REPO},
+      {"name": "repo-never", "check_every": "never", "webhook_token": "secret", **REPO},
+    ],
+    "jobs": [{"name": "build", "plan": [{"get": "repo-never"}]}],
+  }
+
+  deduped = dedupe_resources(config)
+
+  assert [resource["name"] for resource in deduped["resources"]] == ["repo", "repo-tagged", "repo-webhook", "repo-pinned"]
+  assert deduped["resources"][2]["check_every"] == "never"
+  assert deduped["jobs"][0]["plan"][0] == {"get": "repo-never", "resource": "repo-webhook"}
+
+
+def fake_render_fleet(cck_config, names=None, environments=None):
+  for environment in ["dev", "prod"]:
+    fleet_pipeline = FleetPipeline("foo_mgmt", environment, None, "concourse", f"{environment}-foo-mgmt", f"{environment}-foo-mgmt", None)
+    yield fleet_pipeline, yaml.safe_dump({"resources": [{"name": "repo", **REPO}, {"name": f"{environment}-only", "type": "time", "source": {"interval": environment}}]})
+
+
+@patch("concoursekit.render_fleet", side_effect=fake_render_fleet)
+def test_find_duplicate_resources(mock_render_fleet, capsys):
+  duplicates = find_duplicate_resources(None, [], load_config())
+
+  out, err = capsys.readouterr()
+  assert len(duplicates) == 1
+  assert [fleet_pipeline.pipeline_ref for fleet_pipeline, _ in list(duplicates.values())[0]] == ["dev-foo-mgmt", "prod-foo-mgmt"]
+  assert "Up to 60.0 checks/hour are redundant." in out
@@ -0,0 +1,64 @@
+import os
+import yaml
+from concoursekit import fragment
+from concoursekit import write_pipeline
+from concoursekit import load_config
+from concoursekit import FRAGMENTS
+
+
+@fragment
+def busybox_task(message):
+  return {
+    "platform": "linux",
+    "image_resource": {"type": "registry-image", "source": {"repository": "busybox"}},
+    "run": {"path": "echo", "args": [message]}
+  }
+
+
+def build_config():
+  return {
+    "jobs": [
+      {"name": f"job-{index}", "plan": [{"task": "echo", "config": busybox_task("hello")}]}
+      for index in range(3)
+    ]
+  }
+
+
+def test_fragment_is_memoized():
+  FRAGMENTS.clear()
+  assert busybox_task("hello") is busybox_task("hello")
+  assert busybox_task("hello") is not busybox_task("goodbye")
+  assert FRAGMENTS.misses == 2
+
+
+def test_write_pipeline_with_anchors():
+  FRAGMENTS.clear()
+  cck_config = load_config()
+  cck_config["yaml_anchors"] = True
+
+  write_pipeline(build_config(), "anchor_mgmt", cck_config)
+  with open("anchor_mgmt.yml") as file:
+    text = file.read()
+  os.remove("anchor_mgmt.yml")
+
+  assert text.count("&id") == 1
+  assert text.count("*id") == 2
+  assert yaml.safe_load(text) == build_config()
+
+  # the serialized node is reused for the next pipeline
+  write_pipeline(build_config(), "anchor_mgmt", cck_config)
+  os.remove("anchor_mgmt.yml")
+  assert len(FRAGMENTS.nodes) == 1
+
+
+def test_write_pipeline_without_anchors():
+  FRAGMENTS.clear()
+  cck_config = load_config()
+
+  write_pipeline(build_config(), "anchor_mgmt", cck_config)
+  with open("anchor_mgmt.yml") as file:
+    text = file.read()
+  os.remove("anchor_mgmt.yml")
+
+  assert "&id" not in text
+  assert yaml.safe_load(text) == build_config()
@@ -0,0 +1,84 @@
+from unittest import mock
+from unittest.mock import patch
+import json
+import yaml
+from concoursekit import set_pipeline
+from concoursekit import find_orphans
+from concoursekit import instance_config
+from concoursekit import load_config
+
+
+class ReturnCode(object):
+  def __init__(self, returncode):
+    self.returncode = returncode
+
+
+def test_instance_config():
+  config = {"jobs": [{"name": "foo-job-dev", "plan": [{"params": {"API": "dev.api.foocorp.int", "MODE": "devices"}}]}]}
+  assert instance_config(config, "dev") == {
+    "jobs": [{"name": "foo-job-((env))", "plan": [{"params": {"API": "((env)).api.foocorp.int", "MODE": "devices"}}]}]
+  }
+
+
+def test_instance_config_leaves_vars_alone():
+  config = {"params": {"PASSWORD": "((dev-db-password))", "CREDS": "((vault:dev/creds.password))", "URL": "dev.db/((dev-db-name))/dev"}}
+  assert instance_config(config, "dev") == {
+    "params": {"PASSWORD": "((dev-db-password))", "CREDS": "((vault:dev/creds.password))", "URL": "((env)).db/((dev-db-name))/((env))"}
+  }
+
+
+@patch("concoursekit.fly_run")
+def test_set_instanced_pipeline(mock_fly_run, tmp_path):
+  cck_config = load_config()
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
+  cck_config["instanced_pipelines"] = True
+
+  configs = {}
+  def read_config(command, **kwargs):
+    if "set-pipeline" in command:
+      with open(command[command.index("--config") + 1]) as file:
+        configs[command[-2]] = yaml.safe_load(file)
+    return ReturnCode(0)
+  mock_fly_run.side_effect = read_config
+
+  set_pipeline(
+    name="foo_mgmt",
+    environments=["dev", "prod"],
+    all_flag=False,
+    cck_config=cck_config,
+    plan_flag=False
+  )
+
+  mock_fly_run.assert_has_calls([
+    mock.call(['fly', '-t', 'concourse', 'set-pipeline', '--pipeline', 'foo-mgmt-install', '--config', 'dev-foo-mgmt-install.yml', '--instance-var', 'env=dev', '--non-interactive']),
+    mock.call(['fly', '-t', 'concourse', 'hide-pipeline', '--pipeline', 'foo-mgmt-install/env:dev']),
+    mock.call(['fly', '-t', 'concourse', 'unpause-pipeline', '--pipeline', 'foo-mgmt-install/env:dev'])
+  ])
+  mock_fly_run.assert_has_calls([
+    mock.call(['fly', '-t', 'concourse', 'set-pipeline', '--pipeline', 'foo-mgmt-install', '--config', 'prod-foo-mgmt-install.yml', '--instance-var', 'env=prod', '--non-interactive']),
+  ])
+
+  # prod renders to the same config every other single-job environment would
+  assert configs["env=prod"]["jobs"][0]["name"] == "foo-job-((env))"
+  assert len(configs["env=dev"]["jobs"]) == 2
+
+
+@patch("concoursekit.fly_run")
+def test_instanced_orphans(mock_fly_run, tmp_path):
+  cck_config = load_config()
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
+  cck_config["instanced_pipelines"] = True
+
+  class FlyOutput(object):
+    returncode = 0
+    stdout = json.dumps([
+      {"name": "foo-mgmt-install", "instance_vars": {"env": "dev"}},
+      {"name": "foo-mgmt-install", "instance_vars": {"env": "prod-two"}},
+      {"name": "hand-made-pipeline", "instance_vars": None},
+    ])
+  mock_fly_run.return_value = FlyOutput()
+  with open(cck_config["managed_pipelines_file"], "w") as file:
+    json.dump({"concourse": ["foo-mgmt-install/env:dev", "foo-mgmt-install/env:prod-two"]}, file)
+
+  orphans = find_orphans(cck_config, destroy_flag=False)
+  assert orphans["concourse"] == ["foo-mgmt-install/env:prod-two"]
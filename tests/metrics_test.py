@@ -0,0 +1,62 @@
+import json
+import subprocess
+from unittest.mock import patch
+import pytest
+import concoursekit
+from concoursekit import load_config
+from concoursekit import set_pipeline
+
+
+@pytest.fixture(autouse=True)
+def metrics():
+  concoursekit.METRICS.clear()
+  yield concoursekit.METRICS
+  concoursekit.METRICS.clear()
+
+
+def completed(returncode):
+  return lambda command, **kwargs: subprocess.CompletedProcess(command, returncode)
+
+
+@patch("concoursekit.subprocess.run")
+def test_set_pipeline_metrics(mock_run, metrics, tmp_path):
+  mock_run.side_effect = completed(0)
+  cck_config = load_config()
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
+
+  set_pipeline("foo_mgmt", ["dev"], False, cck_config, False)
+  metrics.write(str(tmp_path / "cck.prom"), str(tmp_path / "events.jsonl"))
+
+  text = (tmp_path / "cck.prom").read_text()
+  assert 'cck_render_duration_seconds{pipeline="dev-foo-mgmt-install",environment="dev",cached="false"}' in text
+  assert 'cck_render_yaml_bytes{pipeline="dev-foo-mgmt-install",environment="dev"}' in text
+  assert 'cck_fly_calls_total{target="concourse",command="set-pipeline"} 1' in text
+  assert 'cck_fly_calls_total{target="concourse",command="hide-pipeline"} 1' in text
+  assert 'cck_fly_call_duration_seconds_count{target="concourse",command="set-pipeline"} 1' in text
+  assert 'cck_pipelines_total{outcome="set"} 1' in text
+  assert 'cck_pipelines_total{outcome="skipped"} 0' in text
+  assert "# TYPE cck_fly_calls counter" in text
+  assert text.endswith("# EOF\n")
+
+  events = [json.loads(line) for line in (tmp_path / "events.jsonl").read_text().splitlines()]
+  assert [event["event"] for event in events] == ["render", "fly", "fly", "fly", "pipeline"]
+  assert events[-1]["pipeline"] == "dev-foo-mgmt-install"
+  assert events[-1]["outcome"] == "set"
+
+
+@patch("concoursekit.subprocess.run")
+def test_validation_failures(mock_run, metrics):
+  mock_run.side_effect = completed(1)
+  cck_config = load_config()
+
+  set_pipeline("foo_mgmt", ["dev", "stage"], False, cck_config, True)
+
+  text = metrics.openmetrics()
+  assert 'cck_validation_failures_total{pipeline="dev-foo-mgmt-install"} 1' in text
+  assert 'cck_validation_failures_total{pipeline="stage-foo-mgmt-install"} 1' in text
+  assert 'cck_fly_call_failures_total{target="",command="validate-pipeline"} 2' in text
+
+
+def test_label_values_are_escaped(metrics):
+  metrics.render('odd"name\\', "dev", 0.5, 10)
+  assert 'cck_render_yaml_bytes{pipeline="odd\\"name\\\\",environment="dev"} 10' in metrics.openmetrics()
@@ -0,0 +1,93 @@
+import os
+import tracemalloc
+import pytest
+import yaml
+from concoursekit import Job, Task, TaskConfig, Get, Resource, Pipeline
+from concoursekit import generate_pipeline
+from concoursekit import load_config
+
+
+def build_dict_job(index):
+  return {
+    "name": f"job-{index}",
+    "plan": [
+      {"get": "source-code", "trigger": True},
+      {
+        "task": f"task-{index}",
+        "config": {
+          "platform": "linux",
+          "image_resource": {"type": "registry-image", "source": {"repository": "busybox"}},
+          "run": {"path": "echo", "args": [f"hello {index}"]}
+        }
+      }
+    ]
+  }
+
+
+def build_node_job(index):
+  return Job(
+    name=f"job-{index}",
+    plan=[
+      Get(get="source-code", trigger=True),
+      Task(
+        task=f"task-{index}",
+        config=TaskConfig(
+          platform="linux",
+          image_resource={"type": "registry-image", "source": {"repository": "busybox"}},
+          run={"path": "echo", "args": [f"hello {index}"]}
+        )
+      )
+    ]
+  )
+
+
+def test_node_serializes_like_dict():
+  assert build_node_job(1).to_dict() == build_dict_job(1)
+  assert build_node_job(1) == build_node_job(1)
+  assert hash(build_node_job(1)) == hash(build_node_job(1))
+  assert build_node_job(1) != build_node_job(2)
+
+
+def test_nodes_are_immutable():
+  job = build_node_job(1)
+  with pytest.raises(AttributeError):
+    job.name = "other"
+  assert job.replace(name="other").to_dict()["name"] == "other"
+
+
+def test_unknown_field():
+  with pytest.raises(TypeError):
+    Resource(name="repo", kind="git")
+  assert Resource(name="repo", type="git", extra={"expose_build_created_by": True}).to_dict()["expose_build_created_by"]
+
+
+def test_nodes_use_less_memory():
+  def retained_memory(build, serialize):
+    tracemalloc.start()
+    jobs = [build(index) for index in range(2000)]
+    # as generate_pipeline does, while the jobs are still held i.e. by a fragment
+    serialize(jobs)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+  node_size = retained_memory(build_node_job, lambda jobs: Pipeline(jobs=jobs).to_dict())
+  assert node_size < retained_memory(build_dict_job, lambda jobs: {"jobs": jobs}) * 0.9
+
+
+def test_generate_pipeline_node():
+  class NodePipeline(object):
+    @staticmethod
+    def pipeline_config():
+      return Pipeline(
+        resources=[Resource(name="source-code", type="git", source={"uri": "https://example.com/repo.git"})],
+        jobs=[build_node_job(1)]
+      )
+
+  generate_pipeline("node_mgmt", ["dev"], load_config(), False, NodePipeline)
+  with open("node_mgmt.yml") as file:
+    config = yaml.safe_load(file)
+  os.remove("node_mgmt.yml")
+
+  assert config["jobs"] == [build_dict_job(1)]
+  assert config["resources"][0]["name"] == "source-code"
@@ -0,0 +1,99 @@
+from unittest import mock
+from unittest.mock import patch
+import json
+import pytest
+from concoursekit import find_orphans
+from concoursekit import load_config
+from concoursekit import set_pipeline
+
+
+class FlyOutput(object):
+  def __init__(self, returncode, stdout=b""):
+    self.returncode = returncode
+    self.stdout = stdout
+
+
+LIVE_PIPELINES = {
+  "concourse": ["dev-foo-mgmt-install", "dev-old-mgmt", "dev-experiment", "hand-made-pipeline"],
+  "my-team": ["dev-bar-mgmt", "sandbox-bar-mgmt", "dev-baz-mgmt"],
+}
+
+# the pipelines cck has set, dev-experiment and hand-made-pipeline were set by hand
+MANAGED_PIPELINES = {
+  "concourse": ["dev-foo-mgmt-install", "dev-old-mgmt"],
+  "my-team": ["dev-bar-mgmt", "dev-baz-mgmt"],
+}
+
+
+def fake_fly_run(command, **kwargs):
+  if "pipelines" in command:
+    target = command[command.index("-t") + 1]
+    return FlyOutput(0, json.dumps([{"name": name} for name in LIVE_PIPELINES.get(target, [])]))
+  return FlyOutput(0)
+
+
+@pytest.fixture
+def cck_config(tmp_path):
+  cck_config = load_config()
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
+  with open(cck_config["managed_pipelines_file"], "w") as file:
+    json.dump(MANAGED_PIPELINES, file)
+  return cck_config
+
+
+@patch("concoursekit.fly_run", side_effect=fake_fly_run)
+def test_find_orphans(mock_fly_run, cck_config, capsys):
+
+  orphans = find_orphans(cck_config, destroy_flag=False)
+
+  out, err = capsys.readouterr()
+  assert orphans["concourse"] == ["dev-old-mgmt"]
+  assert orphans["my-team"] == []
+  assert "dev-old-mgmt" in out
+  assert "hand-made-pipeline" not in out
+  assert "dev-experiment" not in out
+
+  # the live list is fetched once per target
+  list_calls = [call for call in mock_fly_run.call_args_list if "pipelines" in call.args[0]]
+  assert len(list_calls) == len(set(call.args[0][2] for call in list_calls))
+
+
+@patch("concoursekit.time.sleep")
+@patch("concoursekit.fly_run", side_effect=fake_fly_run)
+def test_destroy_orphans(mock_fly_run, mock_sleep, cck_config):
+  find_orphans(cck_config, destroy_flag=True)
+
+  mock_fly_run.assert_has_calls([
+    mock.call(['fly', '-t', 'concourse', 'destroy-pipeline', '--pipeline', 'dev-old-mgmt', '--non-interactive']),
+  ])
+  destroy_calls = [call for call in mock_fly_run.call_args_list if "destroy-pipeline" in call.args[0]]
+  assert len(destroy_calls) == 1
+
+  # a destroyed pipeline is forgotten
+  with open(cck_config["managed_pipelines_file"]) as file:
+    assert json.load(file)["concourse"] == ["dev-foo-mgmt-install"]
+
+
+@patch("concoursekit.fly_run", side_effect=fake_fly_run)
+def test_orphans_on_target_without_pipelines(mock_fly_run, cck_config):
+  # the only pipeline set on retired-team has been removed
+  with open(cck_config["managed_pipelines_file"], "w") as file:
+    json.dump(MANAGED_PIPELINES | {"retired-team": ["prod-gone-mgmt"]}, file)
+
+  with patch.dict(LIVE_PIPELINES, {"retired-team": ["prod-gone-mgmt", "prod-by-hand"]}):
+    orphans = find_orphans(cck_config, destroy_flag=False)
+
+  assert orphans["retired-team"] == ["prod-gone-mgmt"]
+
+
+@patch("concoursekit.fly_run", side_effect=fake_fly_run)
+def test_set_pipelines_are_managed(mock_fly_run, tmp_path):
+  cck_config = load_config()
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
+
+  set_pipeline("foo_mgmt", ["dev"], False, cck_config, False)
+  with patch.dict(LIVE_PIPELINES, {"concourse": ["dev-foo-mgmt-install", "prod-foo-mgmt-install"]}):
+    assert find_orphans(cck_config, destroy_flag=False)["concourse"] == []
+
+  with open(cck_config["managed_pipelines_file"]) as file:
+    assert json.load(file) == {"concourse": ["dev-foo-mgmt-install"]}
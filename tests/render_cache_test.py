@@ -0,0 +1,96 @@
+from unittest.mock import patch
+import os
+import shutil
+import concoursekit
+from concoursekit import generate_pipeline
+from concoursekit import load_config
+from concoursekit import local_imports
+from concoursekit import RenderCache
+
+
+def render(cck_config, environment):
+  generate_pipeline(name="foo_mgmt", environments=[environment], cck_config=cck_config, plan_flag=True)
+  with open("foo_mgmt.yml") as file:
+    text = file.read()
+  os.remove("foo_mgmt.yml")
+  return text
+
+
+def test_cache_hit_skips_import(tmp_path):
+  cck_config = load_config()
+  cck_config["render_cache_dir"] = str(tmp_path)
+
+  rendered = render(cck_config, "dev")
+  assert len(list(tmp_path.glob("*.yml"))) == 1
+
+  with patch("concoursekit.import_pipeline", wraps=concoursekit.import_pipeline) as mock_import_pipeline:
+    assert render(cck_config, "dev") == rendered
+    mock_import_pipeline.assert_not_called()
+
+    # a different environment is a different key
+    render(cck_config, "prod")
+    mock_import_pipeline.assert_called_once()
+
+
+def test_cache_key_changes_with_vars(tmp_path):
+  shutil.copytree("target-environments", tmp_path / "target-environments")
+  cck_config = load_config()
+  cck_config["render_cache_dir"] = str(tmp_path / "cache")
+  cck_config["target_environments_dir"] = str(tmp_path / "target-environments")
+  render_cache = RenderCache(cck_config)
+
+  dev_key = render_cache.key("foo_mgmt", "dev")
+  stage_key = render_cache.key("foo_mgmt", "stage")
+  assert render_cache.key("foo_mgmt", "dev") == dev_key
+
+  # i.e. stage promoting what is in prod's vars
+  with open(tmp_path / "target-environments" / "prod" / "vars.yml", "a") as file:
+    file.write("another-var: true\n")
+  assert render_cache.key("foo_mgmt", "dev") != dev_key
+  assert render_cache.key("foo_mgmt", "stage") != stage_key
+  assert render_cache.key("missing_mgmt", "dev") is None
+
+
+@patch("concoursekit.hash_file", wraps=concoursekit.hash_file)
+def test_files_are_hashed_once(mock_hash_file, tmp_path):
+  shutil.copytree("target-environments", tmp_path / "target-environments")
+  cck_config = load_config()
+  cck_config["render_cache_dir"] = str(tmp_path / "cache")
+  cck_config["target_environments_dir"] = str(tmp_path / "target-environments")
+  render_cache = RenderCache(cck_config)
+
+  render_cache.key("foo_mgmt", "dev")
+  hashed = {call.args[0] for call in mock_hash_file.call_args_list}
+  assert os.path.join(cck_config["target_environments_dir"], "prod", "vars.yml") in hashed
+
+  mock_hash_file.reset_mock()
+  render_cache.key("foo_mgmt", "stage")
+  RenderCache(cck_config).key("foo_mgmt", "prod")
+  mock_hash_file.assert_not_called()
+
+  # only the changed file is hashed again
+  with open(tmp_path / "target-environments" / "prod" / "vars.yml", "a") as file:
+    file.write("another-var: true\n")
+  render_cache.key("foo_mgmt", "dev")
+  mock_hash_file.assert_called_once_with(os.path.join(cck_config["target_environments_dir"], "prod", "vars.yml"))
+
+
+def test_local_imports(tmp_path):
+  (tmp_path / "helpers").mkdir()
+  (tmp_path / "helpers" / "__init__.py").write_text("")
+  (tmp_path / "helpers" / "tasks.py").write_text("from . import images\n")
+  (tmp_path / "helpers" / "images.py").write_text("import os\n")
+  (tmp_path / "pipeline.py").write_text("import yaml\nfrom helpers.tasks import build_task\n")
+
+  cwd = os.getcwd()
+  os.chdir(tmp_path)
+  try:
+    found = local_imports("pipeline.py")
+  finally:
+    os.chdir(cwd)
+
+  assert found == {
+    os.path.join("helpers", "__init__.py"),
+    os.path.join("helpers", "tasks.py"),
+    os.path.join("helpers", "images.py"),
+  }
@@ -0,0 +1,117 @@
+import os
+import threading
+from unittest.mock import patch
+import pytest
+from concoursekit import RenderLimitExceeded
+from concoursekit import generate_pipeline
+from concoursekit import import_pipeline
+from concoursekit import load_config
+from concoursekit import set_pipeline
+
+
+PIPELINE = """
+import threading
+import time
+from concoursekit import env
+
+LOCK = threading.Lock()
+
+pipeline_environments = ["dev", "stage"]
+
+def pipeline_config():
+  if env("ENVIRONMENT") == "dev":
+    {behaviour}
+  return {{"jobs": [{{"name": "job-" + env("ENVIRONMENT"), "plan": []}}]}}
+"""
+
+
+class ReturnCode(object):
+  def __init__(self, returncode):
+    self.returncode = returncode
+
+
+@pytest.fixture
+def limited_pipelines(tmp_path, monkeypatch):
+  os.makedirs(tmp_path / "limited_pipelines")
+  behaviours = {
+    "slow_mgmt": "time.sleep(30)",
+    "hungry_mgmt": "hoard = [bytearray(1024 * 1024) for _ in range(1024)]",
+    "broken_mgmt": "raise ValueError('no dev for you')",
+    "locked_mgmt": "with LOCK: pass",
+  }
+  for name, behaviour in behaviours.items():
+    (tmp_path / "limited_pipelines" / f"{name}.py").write_text(PIPELINE.format(behaviour=behaviour))
+  monkeypatch.syspath_prepend(str(tmp_path))
+
+  cck_config = load_config()
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
+  cck_config["pipelines_dir"] = "limited_pipelines"
+  cck_config["render_timeout"] = 5
+  return cck_config
+
+
+def test_supervised_render(limited_pipelines):
+  generate_pipeline("slow_mgmt", ["stage"], limited_pipelines, True)
+
+  with open("slow_mgmt.yml") as file:
+    assert "name: job-stage" in file.read()
+  os.remove("slow_mgmt.yml")
+
+
+@patch("concoursekit.fly_run")
+def test_slow_render_is_skipped(mock_fly_run, limited_pipelines, capsys):
+  mock_fly_run.return_value = ReturnCode(0)
+  limited_pipelines["render_timeout"] = 0.5
+
+  skipped = set_pipeline("slow_mgmt", [], True, limited_pipelines, True)
+
+  out, err = capsys.readouterr()
+  assert skipped == ["dev-slow-mgmt"]
+  assert "Skipping pipeline: dev-slow-mgmt - exceeded render_timeout of 0.5s after" in out
+  assert "peak RSS" in out
+  mock_fly_run.assert_called_once_with(['fly', 'validate-pipeline', '--config', 'stage-slow-mgmt.yml'], stdout=-3)
+
+
+def test_memory_limit(limited_pipelines):
+  limited_pipelines["render_memory_limit"] = 64
+
+  with pytest.raises(RenderLimitExceeded) as e:
+    generate_pipeline("hungry_mgmt", ["dev"], limited_pipelines, True)
+
+  assert "exceeded render_memory_limit of 64MB" in str(e.value)
+  assert not os.path.exists("hungry_mgmt.yml")
+
+
+def test_exception_within_worker(limited_pipelines, capsys):
+  with pytest.raises(SystemExit):
+    generate_pipeline("broken_mgmt", ["dev"], limited_pipelines, True)
+
+  out, err = capsys.readouterr()
+  assert "ENVIRONMENT: dev" in out
+  assert "raise ValueError('no dev for you')" in out
+  assert "Encountered an Python Exception" in out
+
+
+def test_lock_held_by_another_thread(limited_pipelines):
+  # as a TargetScheduler worker might hold a lock while the render starts
+  pipeline = import_pipeline("locked_mgmt", "limited_pipelines")
+  held = threading.Event()
+  release = threading.Event()
+
+  def hold():
+    with pipeline.LOCK:
+      held.set()
+      release.wait()
+
+  thread = threading.Thread(target=hold)
+  thread.start()
+  held.wait()
+  try:
+    generate_pipeline("locked_mgmt", ["dev"], limited_pipelines, True, pipeline)
+  finally:
+    release.set()
+    thread.join()
+
+  with open("locked_mgmt.yml") as file:
+    assert "name: job-dev" in file.read()
+  os.remove("locked_mgmt.yml")
@@ -0,0 +1,104 @@
+from unittest.mock import patch
+import glob
+import os
+import subprocess
+import sys
+import threading
+import pytest
+import yaml
+import concoursekit
+from concoursekit import client_request
+from concoursekit import load_config
+from concoursekit import RenderServer
+
+
+class ReturnCode(object):
+  def __init__(self, returncode):
+    self.returncode = returncode
+    self.stdout = b""
+
+
+@pytest.fixture(autouse=True)
+def remove_renders():
+  # the client writes renders into the working directory, removed even when a test fails
+  before = set(glob.glob("*.yml"))
+  yield
+  for file_path in set(glob.glob("*.yml")) - before:
+    os.remove(file_path)
+
+
+@pytest.fixture
+def cck_config(tmp_path):
+  cck_config = load_config()
+  cck_config["server_socket"] = str(tmp_path / "cck.sock")
+  server = RenderServer(cck_config["server_socket"], cck_config)
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  yield cck_config
+  server.shutdown()
+  server.server_close()
+
+
+def test_render_request(cck_config, capsys):
+  response = client_request("render", "foo_mgmt", ["dev"], cck_config)
+
+  assert response["ok"]
+  assert os.path.exists("dev-foo-mgmt-install.yml")
+  with open("dev-foo-mgmt-install.yml") as file:
+    assert "foo-job-dev" in file.read()
+
+
+@patch("concoursekit.fly_run")
+def test_plan_and_validate_requests(mock_fly_run, cck_config, capsys):
+  mock_fly_run.return_value = ReturnCode(0)
+
+  response = client_request("plan", "foo_mgmt", ["dev"], cck_config)
+  assert "dev-foo-mgmt-install | concourse" in response["output"]
+
+  response = client_request("validate", None, ["dev"], cck_config)
+  assert response["valid"] == {
+    "dev-bar-mgmt": True,
+    "dev-baz-mgmt": True,
+    "dev-foo-mgmt-install": True,
+    "dev-zoo-mgmt-install-dev": True,
+  }
+
+
+def test_failed_request(cck_config, capsys):
+  with pytest.raises(SystemExit):
+    client_request("render", "blah_mgmt", ["dev"], cck_config)
+  out, err = capsys.readouterr()
+  assert "Pipeline blah_mgmt.py does not exist" in out
+
+
+def test_metrics_are_written_per_request(cck_config, tmp_path, capsys):
+  cck_config["metrics_file"] = str(tmp_path / "cck.prom")
+  cck_config["events_file"] = str(tmp_path / "events.jsonl")
+
+  client_request("render", "foo_mgmt", ["dev"], cck_config)
+  assert 'pipeline="dev-foo-mgmt-install",environment="dev"' in (tmp_path / "cck.prom").read_text()
+
+  client_request("render", "bar_mgmt", ["dev"], cck_config)
+  metrics = (tmp_path / "cck.prom").read_text()
+  assert 'pipeline="dev-bar-mgmt",environment="dev"' in metrics
+  assert "dev-foo-mgmt-install" not in metrics
+  assert len((tmp_path / "events.jsonl").read_text().splitlines()) == 1
+
+
+def test_client_keeps_the_server_metrics(cck_config, tmp_path):
+  cck_config["metrics_file"] = str(tmp_path / "cck.prom")
+
+  # the client runs as a process of its own, sharing the server's .cck.yml
+  client_config = {key: os.path.abspath(value) if key.endswith("_dir") and value else value for key, value in cck_config.items()}
+  with open(tmp_path / ".cck.yml", "w") as file:
+    yaml.safe_dump(client_config, file)
+  client = subprocess.run(
+    [sys.executable, "-c", "from concoursekit import main; main()", "--client", "render", "--name", "foo_mgmt", "--env", "dev"],
+    cwd=tmp_path,
+    env={**os.environ, "PYTHONPATH": os.path.dirname(os.path.dirname(os.path.abspath(concoursekit.__file__)))}
+  )
+
+  assert client.returncode == 0
+  assert (tmp_path / "dev-foo-mgmt-install.yml").exists()
+  metrics = (tmp_path / "cck.prom").read_text()
+  assert 'cck_render_duration_seconds{pipeline="dev-foo-mgmt-install",environment="dev",cached="false"}' in metrics
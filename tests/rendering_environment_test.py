@@ -0,0 +1,139 @@
+import os
+import threading
+import pytest
+from unittest.mock import patch
+from concoursekit import env
+from concoursekit import load_config
+from concoursekit import rendering_environment
+from concoursekit import set_pipeline
+
+
+PIPELINE = """
+import threading
+import time
+from concoursekit import env
+
+pipeline_environments = ["dev", "stage", "prod", "sandbox"]
+pipeline_render_concurrently = True
+render_threads = set()
+
+def pipeline_config():
+  environment = env("ENVIRONMENT")
+  time.sleep(0.1)  # hold the render open so environments overlap
+  render_threads.add(threading.get_ident())
+  return {"jobs": [{"name": "job-" + env("ENVIRONMENT"), "plan": [{"task": environment}]}]}
+"""
+
+
+YAMLMAKER_PIPELINE = """
+from yamlmaker import env
+
+pipeline_environments = ["dev", "stage", "prod", "sandbox"]
+{opt_in}
+
+def pipeline_config():
+  return {{"jobs": [{{"name": "job-" + env("ENVIRONMENT"), "plan": []}}]}}
+"""
+
+
+class ReturnCode(object):
+  def __init__(self, returncode):
+    self.returncode = returncode
+
+
+def test_env_prefers_the_rendering_environment(monkeypatch):
+  monkeypatch.setenv("ENVIRONMENT", "stage")
+  monkeypatch.delenv("CCK_UNSET_VARIABLE", raising=False)
+  assert env("ENVIRONMENT") == "stage"
+  assert env("CCK_UNSET_VARIABLE") == ""
+
+  with rendering_environment("dev"):
+    assert env("ENVIRONMENT") == "dev"
+  assert env("ENVIRONMENT") == "dev"  # os.environ is left as it was for yamlmaker.env
+
+
+def test_rendering_environment_is_thread_local():
+  barrier = threading.Barrier(3, timeout=5)
+  seen = {}
+
+  def render(environment):
+    with rendering_environment(environment):
+      barrier.wait()  # every thread has entered its environment before any reads it
+      seen[environment] = env("ENVIRONMENT")
+
+  threads = [threading.Thread(target=render, args=(environment,)) for environment in ["dev", "stage", "prod"]]
+  for thread in threads: thread.start()
+  for thread in threads: thread.join()
+
+  assert seen == {"dev": "dev", "stage": "stage", "prod": "prod"}
+
+
+@patch("concoursekit.fly_run")
+def test_render_workers_render_opted_in_environments_concurrently(mock_fly_run, tmp_path, monkeypatch):
+  (tmp_path / "threaded_pipelines").mkdir()
+  (tmp_path / "threaded_pipelines" / "threaded_mgmt.py").write_text(PIPELINE)
+  monkeypatch.syspath_prepend(str(tmp_path))
+
+  cck_config = load_config()
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
+  cck_config["pipelines_dir"] = "threaded_pipelines"
+  cck_config["render_workers"] = 4
+
+  rendered = {}
+  def validate(command, **kwargs):
+    with open(command[-1]) as file:
+      rendered[command[-1]] = file.read()
+    return ReturnCode(0)
+  mock_fly_run.side_effect = validate
+
+  set_pipeline("threaded_mgmt", [], True, cck_config, True)
+
+  assert sorted(rendered) == ["dev-threaded-mgmt.yml", "prod-threaded-mgmt.yml", "sandbox-threaded-mgmt.yml", "stage-threaded-mgmt.yml"]
+  for config_name, text in rendered.items():
+    environment = config_name.split("-")[0]
+    assert f"name: job-{environment}" in text
+    assert f"task: {environment}" in text
+    assert not os.path.exists(config_name)
+
+  import threaded_pipelines.threaded_mgmt
+  assert len(threaded_pipelines.threaded_mgmt.render_threads) > 1
+
+
+def render_yamlmaker_pipeline(name, opt_in, tmp_path, monkeypatch, mock_fly_run):
+  (tmp_path / "yamlmaker_pipelines").mkdir(exist_ok=True)
+  (tmp_path / "yamlmaker_pipelines" / f"{name}.py").write_text(YAMLMAKER_PIPELINE.format(opt_in=opt_in))
+  monkeypatch.syspath_prepend(str(tmp_path))
+
+  cck_config = load_config()
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
+  cck_config["pipelines_dir"] = "yamlmaker_pipelines"
+  cck_config["render_workers"] = 4
+
+  rendered = {}
+  def validate(command, **kwargs):
+    with open(command[-1]) as file:
+      rendered[command[-1]] = file.read()
+    return ReturnCode(0)
+  mock_fly_run.side_effect = validate
+
+  set_pipeline(name, [], True, cck_config, True)
+  return rendered
+
+
+@patch("concoursekit.fly_run")
+def test_pipelines_render_serially_unless_opted_in(mock_fly_run, tmp_path, monkeypatch):
+  rendered = render_yamlmaker_pipeline("serial_mgmt", "", tmp_path, monkeypatch, mock_fly_run)
+
+  assert len(rendered) == 4
+  for config_name, text in rendered.items():
+    assert f"name: job-{config_name.split('-')[0]}" in text
+
+
+@patch("concoursekit.fly_run")
+def test_yamlmaker_env_refuses_to_render_concurrently(mock_fly_run, tmp_path, monkeypatch, capsys):
+  with pytest.raises(SystemExit):
+    render_yamlmaker_pipeline("unsafe_mgmt", "pipeline_render_concurrently = True", tmp_path, monkeypatch, mock_fly_run)
+
+  out, err = capsys.readouterr()
+  assert "pipeline_render_concurrently requires reading ENVIRONMENT with concoursekit.env" in out
+  mock_fly_run.assert_not_called()
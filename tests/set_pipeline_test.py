@@ -12,8 +12,9 @@ from concoursekit import load_config
 # Foo Pipeline
 #
 @patch("concoursekit.fly_run")
-def test_set_foo_pipeline_with_one_env(mock_fly_run):
+def test_set_foo_pipeline_with_one_env(mock_fly_run, tmp_path):
   cck_config = load_config()
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
 
   set_pipeline(
     name="foo_mgmt", 
@@ -30,8 +31,9 @@ def test_set_foo_pipeline_with_one_env(mock_fly_run):
   ])
 
 @patch("concoursekit.fly_run")
-def test_set_foo_pipeline_with_multiple_env(mock_fly_run):
+def test_set_foo_pipeline_with_multiple_env(mock_fly_run, tmp_path):
   cck_config = load_config()
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
 
   set_pipeline(
     name="foo_mgmt", 
@@ -53,8 +55,9 @@ def test_set_foo_pipeline_with_multiple_env(mock_fly_run):
   ])
 
 @patch("concoursekit.fly_run")
-def test_set_foo_pipeline_with_all(mock_fly_run):
+def test_set_foo_pipeline_with_all(mock_fly_run, tmp_path):
   cck_config = load_config()
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
 
   set_pipeline(
     name="foo_mgmt", 
@@ -81,9 +84,10 @@ def test_set_foo_pipeline_with_all(mock_fly_run):
   ])
 
 @patch("concoursekit.fly_run")
-def test_set_foo_pipeline_with_no_env(mock_fly_run):
+def test_set_foo_pipeline_with_no_env(mock_fly_run, tmp_path):
   mock_fly_run.reset_mock()
   cck_config = load_config()
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
   set_pipeline(
     name="foo_mgmt", 
     environments=[], 
@@ -102,8 +106,9 @@ def test_set_foo_pipeline_with_no_env(mock_fly_run):
 # Bar Pipeline
 #
 @patch("concoursekit.fly_run")
-def test_set_bar_pipeline_with_one_env(mock_fly_run):
+def test_set_bar_pipeline_with_one_env(mock_fly_run, tmp_path):
   cck_config = load_config()
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
 
   set_pipeline(
     name="bar_mgmt", 
@@ -123,8 +128,9 @@ def test_set_bar_pipeline_with_one_env(mock_fly_run):
 # Baz Pipeline
 #
 @patch("concoursekit.fly_run")
-def test_set_baz_pipeline_with_one_env(mock_fly_run):
+def test_set_baz_pipeline_with_one_env(mock_fly_run, tmp_path):
   cck_config = load_config()
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
 
   set_pipeline(
     name="baz_mgmt", 
@@ -0,0 +1,70 @@
+from unittest.mock import patch
+import os
+import pytest
+from concoursekit import set_pipelines
+from concoursekit import load_config
+
+
+class ReturnCode(object):
+  def __init__(self, returncode):
+    self.returncode = returncode
+
+
+def set_calls(mock_fly_run):
+  return [call.args[0][5] for call in mock_fly_run.call_args_list if "set-pipeline" in call.args[0]]
+
+
+@patch("concoursekit.time.sleep")
+@patch("concoursekit.fly_run")
+def test_resume_after_failure(mock_fly_run, mock_sleep, tmp_path):
+  cck_config = load_config()
+  cck_config["timings_file"] = str(tmp_path / "timings.json")
+  cck_config["journal_file"] = str(tmp_path / "journal.json")
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
+
+  def crash_on_baz(command, **kwargs):
+    if "dev-baz-mgmt" in command:
+      raise KeyboardInterrupt
+    return ReturnCode(0)
+
+  mock_fly_run.side_effect = crash_on_baz
+  with pytest.raises(KeyboardInterrupt):
+    set_pipelines(environments=["dev"], all_flag=True, cck_config=cck_config, plan_flag=False)
+
+  # other concourse targets carry on while my-team fails
+  assert sorted(set_calls(mock_fly_run)) == ["dev-bar-mgmt", "dev-baz-mgmt", "dev-foo-mgmt-install", "dev-zoo-mgmt-install-dev"]
+  assert os.path.exists(cck_config["journal_file"])
+
+  mock_fly_run.reset_mock()
+  mock_fly_run.side_effect = None
+  mock_fly_run.return_value = ReturnCode(0)
+  set_pipelines(environments=["dev"], all_flag=True, cck_config=cck_config, plan_flag=False, resume_flag=True)
+
+  assert set_calls(mock_fly_run) == ["dev-baz-mgmt"]
+  assert not os.path.exists(cck_config["journal_file"])
+
+
+@patch("concoursekit.time.sleep")
+@patch("concoursekit.fly_run")
+def test_resume_after_fly_fails(mock_fly_run, mock_sleep, tmp_path, capsys):
+  cck_config = load_config()
+  cck_config["timings_file"] = str(tmp_path / "timings.json")
+  cck_config["journal_file"] = str(tmp_path / "journal.json")
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
+
+  # i.e. the my-team token expired part way through
+  mock_fly_run.side_effect = lambda command, **kwargs: ReturnCode(1 if "my-team" in command else 0)
+  with pytest.raises(SystemExit):
+    set_pipelines(environments=["dev"], all_flag=True, cck_config=cck_config, plan_flag=False)
+
+  out, err = capsys.readouterr()
+  assert "Failed to set 2 pipelines: my-team/dev-bar-mgmt, my-team/dev-baz-mgmt" in out
+  assert os.path.exists(cck_config["journal_file"])
+
+  mock_fly_run.reset_mock()
+  mock_fly_run.side_effect = None
+  mock_fly_run.return_value = ReturnCode(0)
+  set_pipelines(environments=["dev"], all_flag=True, cck_config=cck_config, plan_flag=False, resume_flag=True)
+
+  assert sorted(set_calls(mock_fly_run)) == ["dev-bar-mgmt", "dev-baz-mgmt"]
+  assert not os.path.exists(cck_config["journal_file"])
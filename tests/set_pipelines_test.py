@@ -9,8 +9,12 @@ from concoursekit import load_config
 
 
 @patch("concoursekit.fly_run")
-def test_set_pipelines_with_one_env(mock_fly_run):
+def test_set_pipelines_with_one_env(mock_fly_run, tmp_path):
   cck_config = load_config()
+  cck_config["timings_file"] = str(tmp_path / "timings.json")
+  cck_config["journal_file"] = str(tmp_path / "journal.json")
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
+  mock_fly_run.return_value.returncode = 0
 
   set_pipelines( 
     environments=["dev"], 
@@ -32,8 +36,12 @@ def test_set_pipelines_with_one_env(mock_fly_run):
   ], any_order=True)
 
 @patch("concoursekit.fly_run")
-def test_set_pipelines_with_two_env(mock_fly_run):
+def test_set_pipelines_with_two_env(mock_fly_run, tmp_path):
   cck_config = load_config()
+  cck_config["timings_file"] = str(tmp_path / "timings.json")
+  cck_config["journal_file"] = str(tmp_path / "journal.json")
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
+  mock_fly_run.return_value.returncode = 0
 
   set_pipelines( 
     environments=["dev", "stage"], 
@@ -64,8 +72,12 @@ def test_set_pipelines_with_two_env(mock_fly_run):
   ], any_order=True)
 
 @patch("concoursekit.fly_run")
-def test_set_pipelines_without_envs(mock_fly_run):
+def test_set_pipelines_without_envs(mock_fly_run, tmp_path):
   cck_config = load_config()
+  cck_config["timings_file"] = str(tmp_path / "timings.json")
+  cck_config["journal_file"] = str(tmp_path / "journal.json")
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
+  mock_fly_run.return_value.returncode = 0
 
   set_pipelines( 
     environments=["!sandbox"], 
@@ -0,0 +1,45 @@
+from unittest.mock import patch
+import json
+from concoursekit import set_pipelines
+from concoursekit import shard_work
+from concoursekit import load_config
+
+
+class ReturnCode(object):
+  def __init__(self, returncode):
+    self.returncode = returncode
+
+
+def test_shard_work_balances_by_duration():
+  durations = {"a": 10.0, "b": 1.0, "c": 1.0, "d": 1.0, "e": None}
+  shards = [shard_work(list(durations), (index, 2), durations.get) for index in (1, 2)]
+
+  assert shards == [["a"], ["b", "c", "d", "e"]]
+  # the same inputs always produce the same shards, regardless of order
+  assert shard_work(list(reversed(list(durations))), (1, 2), durations.get) == ["a"]
+
+
+@patch("concoursekit.fly_run")
+def test_set_pipelines_shards_cover_everything_once(mock_fly_run, tmp_path):
+  cck_config = load_config()
+  mock_fly_run.return_value = ReturnCode(0)
+
+  # every node starts from the same timings, here none, and records its own
+  validated = []
+  timings = {}
+  for index in (1, 2, 3):
+    mock_fly_run.reset_mock()
+    cck_config["timings_file"] = str(tmp_path / f"timings-{index}.json")
+    set_pipelines(environments=["dev", "stage"], all_flag=True, cck_config=cck_config, plan_flag=True, shard=(index, 3))
+    validated += [call.args[0][3] for call in mock_fly_run.call_args_list]
+    with open(cck_config["timings_file"]) as file:
+      timings |= json.load(file)
+
+  assert sorted(validated) == sorted([
+    "dev-bar-mgmt.yml", "stage-bar-mgmt.yml",
+    "dev-baz-mgmt.yml", "stage-baz-mgmt.yml",
+    "dev-foo-mgmt-install.yml", "stage-foo-mgmt-install.yml",
+    "dev-zoo-mgmt-install-dev.yml", "stage-zoo-mgmt-install-stage.yml",
+  ])
+
+  assert set(timings) == {f"{name}/{environment}" for name in ["bar_mgmt", "baz_mgmt", "foo_mgmt", "zoo_mgmt"] for environment in ["dev", "stage"]}
@@ -0,0 +1,63 @@
+import json
+import pytest
+from concoursekit import test_snapshots as run_snapshots
+from concoursekit import diff_configs
+from concoursekit import load_config
+
+
+def test_diff_configs():
+  expected = {"jobs": [{"name": "a", "plan": []}], "resources": []}
+  actual = {"jobs": [{"name": "b", "plan": [], "serial": True}, {"name": "c"}]}
+
+  assert diff_configs(expected, actual) == [
+    "jobs[0].name: 'a' -> 'b'",
+    "jobs[0].serial: added",
+    "jobs[1]: added",
+    "resources: removed",
+  ]
+
+
+def test_snapshots(tmp_path, capsys):
+  cck_config = load_config()
+  cck_config["snapshots_dir"] = str(tmp_path)
+
+  # no snapshots yet
+  with pytest.raises(SystemExit):
+    run_snapshots("foo_mgmt", [], cck_config, update_flag=False)
+
+  passed, failed, updated = run_snapshots("foo_mgmt", [], cck_config, update_flag=True)
+  assert sorted(updated) == ["foo_mgmt/dev", "foo_mgmt/prod", "foo_mgmt/sandbox", "foo_mgmt/stage"]
+  assert (tmp_path / "foo_mgmt" / "dev.yml").exists()
+
+  passed, failed, updated = run_snapshots("foo_mgmt", [], cck_config, update_flag=False)
+  assert len(passed) == 4 and not failed
+
+  snapshot = tmp_path / "foo_mgmt" / "dev.yml"
+  snapshot.write_text(snapshot.read_text().replace("only in dev!", "changed"))
+  manifest = json.loads((tmp_path / "snapshots.json").read_text())
+  del manifest["foo_mgmt/dev"]
+  (tmp_path / "snapshots.json").write_text(json.dumps(manifest))
+
+  capsys.readouterr()
+  with pytest.raises(SystemExit):
+    run_snapshots("foo_mgmt", [], cck_config, update_flag=False)
+  out, err = capsys.readouterr()
+  assert "FAILED foo_mgmt/dev" in out
+  assert "jobs[1].plan[0].config.run.args[0]: 'changed' -> 'only in dev!'" in out
+
+
+def test_edited_snapshot_fails_despite_manifest(tmp_path, capsys):
+  cck_config = load_config()
+  cck_config["snapshots_dir"] = str(tmp_path)
+  run_snapshots("foo_mgmt", ["dev"], cck_config, update_flag=True)
+
+  # i.e. a bad merge of the golden files, the manifest still records the old hash
+  snapshot = tmp_path / "foo_mgmt" / "dev.yml"
+  snapshot.write_text(snapshot.read_text().replace("only in dev!", "wrong"))
+
+  capsys.readouterr()
+  with pytest.raises(SystemExit):
+    run_snapshots("foo_mgmt", ["dev"], cck_config, update_flag=False)
+  out, err = capsys.readouterr()
+  assert "FAILED foo_mgmt/dev" in out
+  assert "0 passed, 1 failed" in out
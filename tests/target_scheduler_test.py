@@ -0,0 +1,115 @@
+from unittest.mock import patch
+import threading
+import pytest
+import time
+from concoursekit import apply_pipeline
+from concoursekit import set_pipelines
+from concoursekit import load_config
+from concoursekit import RateLimiter
+from concoursekit import TargetScheduler
+
+
+class ReturnCode(object):
+  def __init__(self, returncode):
+    self.returncode = returncode
+
+
+@patch("concoursekit.time.sleep")
+@patch("concoursekit.fly_run")
+def test_slow_target_does_not_block_others(mock_fly_run, mock_sleep, tmp_path):
+  cck_config = load_config()
+  cck_config["timings_file"] = str(tmp_path / "timings.json")
+  cck_config["journal_file"] = str(tmp_path / "journal.json")
+  cck_config["managed_pipelines_file"] = str(tmp_path / "managed.json")
+  concourse_done = threading.Event()
+
+  def slow_my_team(command, **kwargs):
+    target = command[2]
+    if target == "my-team":
+      # my-team is only unblocked once the concourse target has been set
+      assert concourse_done.wait(timeout=5)
+    if target == "concourse" and "unpause-pipeline" in command:
+      concourse_done.set()
+    return ReturnCode(0)
+
+  mock_fly_run.side_effect = slow_my_team
+  set_pipelines(environments=["dev"], all_flag=True, cck_config=cck_config, plan_flag=False)
+
+  assert concourse_done.is_set()
+  set_commands = [call.args[0][5] for call in mock_fly_run.call_args_list if "set-pipeline" in call.args[0]]
+  assert sorted(set_commands) == ["dev-bar-mgmt", "dev-baz-mgmt", "dev-foo-mgmt-install", "dev-zoo-mgmt-install-dev"]
+
+
+@patch("concoursekit.fly_run")
+def test_interactive_lock_only_covers_set_pipeline(mock_fly_run, tmp_path, monkeypatch):
+  scheduler = TargetScheduler(load_config())
+  monkeypatch.chdir(tmp_path)
+  for config_name in ["dev-foo-mgmt", "dev-bar-mgmt"]:
+    (tmp_path / f"{config_name}.yml").write_text("jobs: []\n")
+  bar_set = threading.Event()
+
+  def slow_unpause(command, **kwargs):
+    if command[2] == "concourse" and "unpause-pipeline" in command:
+      # my-team may prompt while concourse is still unpausing
+      assert bar_set.wait(timeout=5)
+    if command[2] == "my-team" and "set-pipeline" in command:
+      bar_set.set()
+    return ReturnCode(0)
+  mock_fly_run.side_effect = slow_unpause
+
+  for pipeline_name, concourse_target in [("dev-foo-mgmt", "concourse"), ("dev-bar-mgmt", "my-team")]:
+    scheduler.submit(concourse_target, apply_pipeline, pipeline_name, concourse_target, ["interactive", "unpause-pipeline"], interactive_lock=scheduler.interactive_lock)
+  scheduler.wait()
+  scheduler.shutdown()
+
+  assert bar_set.is_set()
+
+
+def test_target_overrides():
+  cck_config = load_config()
+  cck_config["fly_max_in_flight"] = 2
+  cck_config["concourse_targets"] = {"my-team": {"fly_max_in_flight": 1, "fly_requests_per_second": 5}}
+
+  scheduler = TargetScheduler(cck_config)
+  seen = []
+  scheduler.submit("my-team", lambda rate_limiter: seen.append(rate_limiter.interval))
+  scheduler.submit("concourse", lambda rate_limiter: seen.append(rate_limiter.interval))
+  scheduler.wait()
+  scheduler.shutdown()
+
+  assert sorted(seen) == [0, 0.2]
+
+
+def test_error_on_one_target_does_not_cancel_others():
+  scheduler = TargetScheduler(load_config())
+  failed = threading.Event()
+  ran = []
+
+  def expired_token(rate_limiter):
+    failed.set()
+    raise RuntimeError("token expired")
+
+  def slow_set(rate_limiter):
+    assert failed.wait(timeout=5)
+    time.sleep(0.3)  # still running when the other target has failed
+    ran.append("slow")
+
+  scheduler.submit("my-team", expired_token)
+  scheduler.submit("concourse", slow_set)
+  scheduler.submit("concourse", lambda rate_limiter: ran.append("queued"))
+
+  with pytest.raises(RuntimeError):
+    try:
+      scheduler.wait()
+    finally:
+      scheduler.shutdown()
+
+  assert ran == ["slow", "queued"]
+
+
+def test_rate_limiter():
+  rate_limiter = RateLimiter(20)
+  start = time.monotonic()
+  for _ in range(5):
+    rate_limiter.wait()
+  assert time.monotonic() - start >= 0.2
@@ -0,0 +1,105 @@
+import os
+from unittest.mock import patch
+import pytest
+from concoursekit import Files
+from concoursekit import Sources
+from concoursekit import compile_vars
+from concoursekit import load_config
+from concoursekit import main
+from concoursekit import use_vars_bundle
+
+
+@pytest.fixture
+def cck_config(tmp_path):
+  cck_config = load_config()
+  cck_config["vars_bundle"] = str(tmp_path / "vars.bundle")
+  yield cck_config
+  use_vars_bundle(None)
+
+
+@pytest.fixture
+def environments(tmp_path, monkeypatch):
+  os.makedirs(tmp_path / "envs" / "dev")
+  (tmp_path / "envs" / "dev" / "vars.yml").write_text("api-endpoint: dev.api\nports: [80, 443]\n")
+  (tmp_path / "envs" / "dev" / "dates.yml").write_text("released: 2021-06-01\n")
+  monkeypatch.chdir(tmp_path)
+  yield {"target_environments_dir": "envs", "vars_bundle": "vars.bundle"}
+  use_vars_bundle(None)
+
+
+def test_compile_vars_bundles_target_environments(cck_config, capsys):
+  index = compile_vars(cck_config)
+
+  out, err = capsys.readouterr()
+  assert f"to {cck_config['vars_bundle']}" in out
+  assert "data" in index[os.path.join("target-environments", "dev", "vars.yml")]
+  assert "data" not in index[os.path.join("target-environments", "dev", "trusted-CAs", "something.pem")]
+
+
+def test_sources_and_files_read_from_the_bundle(cck_config):
+  compile_vars(cck_config)
+  use_vars_bundle(cck_config["vars_bundle"])
+
+  with patch("yamlmaker.yaml.load", side_effect=AssertionError("parsed instead of bundled")):
+    sources = Sources({"vars": "target-environments/dev/vars.yml"})
+  assert sources.grab("vars", "api-endpoint") == "dev.api.some.target.foocorp.int"
+
+  pem = "target-environments/dev/trusted-CAs/something.pem"
+  with open(pem) as file:
+    assert Files({"ca": pem}).grab("ca") == file.read()
+
+
+def test_changed_files_are_parsed(environments):
+  compile_vars(environments)
+  use_vars_bundle("vars.bundle")
+
+  # the same contents with a new mtime, as after a fresh checkout, is still bundled
+  os.utime("envs/dev/vars.yml", ns=(0, 0))
+  with patch("yamlmaker.yaml.load", side_effect=AssertionError("parsed instead of bundled")):
+    assert Sources({"vars": "envs/dev/vars.yml"}).grab("vars", "ports.1") == 443
+
+  with open("envs/dev/vars.yml", "w") as file:
+    file.write("api-endpoint: dev.api.changed\n")
+  assert Sources({"vars": "envs/dev/vars.yml"}).grab("vars", "api-endpoint") == "dev.api.changed"
+
+
+def test_values_json_cannot_hold_are_parsed(environments):
+  compile_vars(environments)
+  use_vars_bundle("vars.bundle")
+
+  released = Sources({"dates": os.path.abspath("envs/dev/dates.yml")}).grab("dates", "released")
+  assert released.isoformat() == "2021-06-01"
+
+
+@pytest.mark.parametrize("content", [b"", b"short", b"CCKVARS0" + bytes(16) + b"from an older version of cck"])
+def test_invalid_bundle(environments, content, capsys):
+  with open("vars.bundle", "wb") as file:
+    file.write(content)
+
+  assert use_vars_bundle("vars.bundle") is None
+  out, err = capsys.readouterr()
+  assert "Warning - Vars Bundle: vars.bundle" in out
+
+  # vars are read from their files instead
+  assert Sources({"vars": "envs/dev/vars.yml"}).grab("vars", "api-endpoint") == "dev.api"
+
+
+def test_compile_vars_over_invalid_bundle(environments, capsys):
+  os.makedirs("pipelines")
+  os.makedirs("pipeline_tests")
+  with open(".cck.yml", "w") as file:
+    file.write(
+      "concourse_target: concourse\nfly_default_options: []\npipelines_dir: pipelines\n"
+      "pipelines_test_dir: pipeline_tests\ntarget_environments_dir: envs\nignore_environments: []\n"
+      "vars_bundle: vars.bundle\n"
+    )
+  with open("vars.bundle", "wb") as file:
+    file.write(b"CCKVARS0" + bytes(16))
+
+  with patch("sys.argv", ["cck", "--compile-vars"]):
+    main()
+
+  out, err = capsys.readouterr()
+  assert "Warning" not in out
+  assert "Compiled 2 files" in out
+  assert use_vars_bundle("vars.bundle") is not None